@@ -0,0 +1,60 @@
+"""
+Process-wide data resources shared by the Streamlit pages
+
+Resources are built once per dataset version and handed to every session as the same object
+(st.cache_resource) instead of a per-rerun copy (st.cache_data), so memory stays flat no matter how
+many sessions are open. Copy-on-write keeps the shared frames immutable: any change a page makes to a
+selection or derived frame lands in a private copy. Pages must never assign into the shared frames.
+
+"""
+
+import pandas as pd
+import streamlit as st
+
+import eji_data
+
+if int(pd.__version__.split(".")[0]) < 3:
+    # pandas 3 always copies on write, earlier versions need the option
+    pd.set_option("mode.copy_on_write", True)
+
+
+@st.cache_resource(show_spinner="Loading EJI data...")
+def _tracts(version):
+    return eji_data.load_tracts(columns=[eji_data.POPULATION_COLUMN] + eji_data.measure_columns())
+
+
+@st.cache_resource(show_spinner="Indexing counties...")
+def _county_index(version):
+    return eji_data.CountyIndex(_tracts(version), [eji_data.POPULATION_COLUMN] + eji_data.measure_columns())
+
+
+@st.cache_resource(show_spinner="Aggregating counties...")
+def _county_table(version):
+    return eji_data.county_table(_tracts(version), _county_index(version))
+
+
+def load_tracts():
+    """
+    Tract-level data of the current dataset with derived columns, shared read-only by all sessions
+    :return: DataFrame
+    """
+
+    return _tracts(eji_data.dataset_version())
+
+
+def load_county_index():
+    """
+    County index of the current dataset, see eji_data.CountyIndex
+    :return: CountyIndex
+    """
+
+    return _county_index(eji_data.dataset_version())
+
+
+def load_counties():
+    """
+    County-level table of the current dataset, see eji_data.county_table
+    :return: DataFrame indexed by "County, State"
+    """
+
+    return _county_table(eji_data.dataset_version())
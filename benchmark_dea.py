@@ -0,0 +1,353 @@
+"""
+Benchmark suite for envelopment.DEA
+
+Times DEA.fit() over a grid of unit counts, input/output shapes and model options, on synthetic data
+and on EJI-derived county data, and checks every run against an independent reference LP so that
+speedups cannot silently change the scores. Results are written as JSON for tracking regressions.
+
+Usage:
+    python benchmark_dea.py --sizes 25,100,500 --shapes 12:2,4:2 --output bench.json
+    python benchmark_dea.py --sizes 25,100 --options all --no-memory
+
+"""
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import scipy
+from scipy.optimize import linprog
+
+from envelopment import DEA
+
+DEFAULT_SIZES = "25,50,100,250,500,1000,3000"
+DEFAULT_SHAPES = "12:2,4:2,24:4"  # 12:2 is the dea_measures shape
+
+# assurance regions of the restricted options: 0.5 <= v_0 / v_1 <= 2 and v_1 / v_2 >= 0.25
+ASSURANCE_REGION = [(0, 1, 0.5, 2.0), (1, 2, 0.25, None)]
+
+# named model options of the --options grid, DEA keyword arguments plus the fit options screen and
+# partitions (a number of equal unit blocks); each is checked against the reference LP of its model
+OPTIONS = {
+    "ccr": {},
+    "bcc": {"returns": "variable"},
+    "ccr-output": {"orientation": "output"},
+    "bcc-output": {"returns": "variable", "orientation": "output"},
+    "sbm": {"measure": "sbm"},
+    "sbm-vrs": {"measure": "sbm", "returns": "variable"},
+    "multiplier": {"formulation": "multiplier"},
+    "bcc-multiplier": {"formulation": "multiplier", "returns": "variable"},
+    "assurance": {"restrictions": ASSURANCE_REGION},
+    "assurance-bcc-output": {"restrictions": ASSURANCE_REGION, "returns": "variable", "orientation": "output"},
+    "screen": {"screen": True},
+    "partitions": {"partitions": 4},
+}
+FIT_OPTIONS = ("screen", "partitions")
+
+
+def synthetic_data(n, m, r, seed=0):
+    """
+    Units on a Cobb-Douglas frontier with half-normal inefficiency, scaled into (0, 1]
+    :param n: number of units
+    :param m: number of inputs
+    :param r: number of outputs
+    :param seed: random seed
+    :return: inputs (n x m), outputs (n x r)
+    """
+
+    rng = np.random.default_rng(seed)
+    inputs = rng.uniform(0.05, 1.0, (n, m))
+    elasticities = rng.dirichlet(np.ones(m), size=r)  # one production function per output
+    frontier = np.exp(np.dot(np.log(inputs), elasticities.T))
+    outputs = frontier * np.exp(-np.abs(rng.normal(0.0, 0.3, (n, r))))
+
+    return inputs, outputs / outputs.max(axis=0)
+
+
+def eji_data_sets(sizes, seed=0):
+    """
+    County-level dea_measures data sets, n counties sampled without replacement
+    :param sizes: unit counts
+    :param seed: random seed
+    :return: dict of n -> (inputs, outputs), sizes above the number of counties are skipped
+    """
+
+    import eji_data
+    import preprocessing
+
+    input_measures, output_measures = eji_data.dea_columns()
+    counties = eji_data.county_table()
+    normalized = preprocessing.normalize_frame(counties, input_measures + output_measures)
+
+    rng = np.random.default_rng(seed)
+    data_sets = {}
+    for n in sizes:
+        if n > len(normalized):
+            continue
+        sample = normalized.iloc[np.sort(rng.choice(len(normalized), n, replace=False))]
+        data_sets[n] = preprocessing.dea_arrays(sample, input_measures, output_measures)
+
+    return data_sets
+
+
+def reference_thetas(inputs, outputs, returns="constant", orientation="input", measure="radial", restrictions=None):
+    """
+    Thetas from the multiplier model, formulated independently of envelopment.py; input orientation
+    max u.y_o - u0  s.t.  v.x_o = 1,  u.y_j - v.x_j - u0 <= 0 for all j,  u, v >= 0
+    with u0 = 0 under constant and free under variable returns to scale; output orientation
+    min v.x_o + v0  s.t.  u.y_o = 1,  u.y_j - v.x_j - v0 <= 0 for all j,  theta = 1 / optimum.
+    Each assurance region lower <= w_i / w_j <= upper over w = [v, u] adds the rows
+    w_i - upper * w_j <= 0 and lower * w_j - w_i <= 0.
+    :param inputs: inputs, n x m numpy array
+    :param outputs: outputs, n x r numpy array
+    :param returns: "constant" or "variable"
+    :param orientation: "input" or "output"
+    :param measure: "radial", or "sbm" for reference_sbm
+    :param restrictions: (i, j, lower, upper) assurance regions, None for an open bound
+    :return: array of thetas
+    """
+
+    if measure == "sbm":
+        return reference_sbm(inputs, outputs, returns)
+
+    n, m = inputs.shape
+    r = outputs.shape[1]
+    # columns [v (m), u (r), free scale]
+    rows = [np.hstack([-inputs, outputs, -np.ones((n, 1))])]
+    for i, j, lower, upper in restrictions or ():
+        for sign, bound in ((1.0, upper), (-1.0, lower)):
+            if bound is not None:
+                row = np.zeros((1, m + r + 1))
+                row[0, i], row[0, j] = sign, -sign * bound
+                rows.append(row)
+    A_ub = np.vstack(rows)
+    b_ub = np.zeros(len(A_ub))
+    bounds = [(0, None)] * (m + r) + [(None, None) if returns == "variable" else (0, 0)]
+    thetas = np.zeros(n)
+    for unit in range(n):
+        if orientation == "input":
+            c = np.concatenate([np.zeros(m), -outputs[unit], [1.0]])
+            A_eq = np.concatenate([inputs[unit], np.zeros(r), [0.0]])[np.newaxis, :]
+        else:
+            c = np.concatenate([inputs[unit], np.zeros(r), [1.0]])
+            A_eq = np.concatenate([np.zeros(m), outputs[unit], [0.0]])[np.newaxis, :]
+        res = linprog(c, A_ub=A_ub, b_ub=b_ub, A_eq=A_eq, b_eq=[1.0], bounds=bounds, method="highs")
+        thetas[unit] = -res.fun if orientation == "input" else 1.0 / res.fun
+
+    return thetas
+
+
+def reference_sbm(inputs, outputs, returns="constant"):
+    """
+    Tone's slack-based measure in its fractional form, linearized by Charnes-Cooper, formulated
+    independently of envelopment.py; columns [t, s- (m), s+ (r), Lambda (n)]:
+    min t - 1/m sum_i s-_i / x_io  s.t.  t + 1/r sum_r s+_r / y_ro = 1,
+    X Lambda + s- = t x_o,  Y Lambda - s+ = t y_o,  (sum Lambda = t),  all >= 0
+    :param inputs: inputs, n x m numpy array
+    :param outputs: outputs, n x r numpy array
+    :param returns: "constant" or "variable"
+    :return: array of rhos
+    """
+
+    # the measure is units invariant, dividing by the column maxima keeps tiny measures above the solver tolerances
+    inputs, outputs = inputs / inputs.max(axis=0), outputs / outputs.max(axis=0)
+    n, m = inputs.shape
+    r = outputs.shape[1]
+    rhos = np.zeros(n)
+    for unit in range(n):
+        x, y = inputs[unit], outputs[unit]
+        c = np.concatenate([[1.0], -1.0 / (m * x), np.zeros(r + n)])
+        rows = [np.concatenate([[1.0], np.zeros(m), 1.0 / (r * y), np.zeros(n)])]
+        rows.extend(np.concatenate([[-x[i]], np.eye(m)[i], np.zeros(r), inputs[:, i]]) for i in range(m))
+        rows.extend(np.concatenate([[-y[k]], np.zeros(m), -np.eye(r)[k], outputs[:, k]]) for k in range(r))
+        if returns == "variable":
+            rows.append(np.concatenate([[-1.0], np.zeros(m + r), np.ones(n)]))
+        b_eq = np.zeros(len(rows))
+        b_eq[0] = 1.0
+        res = linprog(c, A_eq=np.array(rows), b_eq=b_eq, bounds=(0, None), method="highs")
+        rhos[unit] = res.fun
+
+    return rhos
+
+
+def split_options(options, n):
+    """
+    Split model options into DEA and DEA.fit keyword arguments
+    :param options: dict, see OPTIONS
+    :param n: number of units, for the partitions
+    :return: DEA keyword arguments, fit keyword arguments
+    """
+
+    model = {key: value for key, value in options.items() if key not in FIT_OPTIONS}
+    fit = {key: value for key, value in options.items() if key in FIT_OPTIONS}
+    if "partitions" in fit:
+        fit["partitions"] = np.array_split(np.arange(n), fit["partitions"])
+
+    return model, fit
+
+
+def peak_rss(inputs, outputs, n_jobs, options):
+    """
+    Peak resident memory of one fit, run in a fresh process so the high-water marks are its own;
+    covers native solver allocations and, through RUSAGE_CHILDREN, the worker processes
+    :return: peak RSS of the fitting process in MB, largest peak RSS of its workers in MB (None without workers)
+    """
+
+    model, fit = split_options(options, inputs.shape[0])
+    dea = DEA(inputs, outputs, **model)
+    with contextlib.redirect_stdout(io.StringIO()):
+        dea.fit(n_jobs=n_jobs, **fit)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+    # ru_maxrss is in kB on Linux
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+            children / 1024.0 if children > 0 else None)
+
+
+def run_case(inputs, outputs, n_jobs, repeat, memory, options):
+    """
+    Time DEA.fit() on one data set
+    :param options: model options, see OPTIONS
+    :return: dict of measurements and the fitted thetas
+    """
+
+    model, fit = split_options(options, inputs.shape[0])
+    times = []
+    unit_times = []
+    for _ in range(repeat):
+        dea = DEA(inputs, outputs, **model)
+        solved = []
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            dea.fit(n_jobs=n_jobs, progress=lambda unit, theta: solved.append(time.perf_counter()), **fit)
+        times.append(time.perf_counter() - start)
+        # serial fits report each unit as it is solved, so consecutive reports time one unit's solve
+        if n_jobs == 1 and len(solved) > 1:
+            unit_times.extend(np.diff(solved))
+
+    peak, worker_peak = None, None
+    if memory:
+        # separate pass in a fresh process, the high-water marks of this one cover every earlier case
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            peak, worker_peak = pool.submit(peak_rss, inputs, outputs, n_jobs, options).result()
+
+    wall = min(times)
+    return {
+        "wall_s": wall,
+        "wall_per_unit_ms": 1000.0 * wall / inputs.shape[0],
+        "unit_solve_ms_median": 1000.0 * float(np.median(unit_times)) if unit_times else None,
+        "unit_solve_ms_p95": 1000.0 * float(np.percentile(unit_times, 95)) if unit_times else None,
+        "peak_rss_mb": peak,
+        "worker_peak_rss_mb": worker_peak,
+        "model": type(dea.model).__name__,
+        "frontier_size": int(len(dea.frontier)),
+        "lambda_nnz": int(dea.lambdas.nnz),
+    }, dea.efficiency[:, 0]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark envelopment.DEA")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="comma-separated unit counts")
+    parser.add_argument("--shapes", default=DEFAULT_SHAPES, help="comma-separated inputs:outputs shapes")
+    parser.add_argument("--datasets", default="synthetic,eji", help="synthetic and/or eji")
+    parser.add_argument("--n-jobs", type=int, default=1, help="worker processes passed to DEA.fit")
+    parser.add_argument("--screen", action="store_true", help="pre-screen the frontier in DEA.fit")
+    parser.add_argument("--formulation", default="auto", choices=DEA.formulations,
+                        help="LP form of the model, auto picks it from the problem shape")
+    parser.add_argument("--options", default="ccr",
+                        help="comma-separated model options to run, all for every one of: %s" % ", ".join(OPTIONS))
+    parser.add_argument("--repeat", type=int, default=1, help="timed runs per case, the fastest is kept")
+    parser.add_argument("--no-memory", action="store_true", help="skip the peak-memory pass in a fresh process")
+    parser.add_argument("--reference-max-n", type=int, default=1000,
+                        help="largest n checked against the reference LP (it costs about one more solve)")
+    parser.add_argument("--tolerance", type=float, default=1e-6, help="largest accepted theta deviation")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--output", default="-", help="JSON output path, - for stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(",")]
+    shapes = [tuple(int(d) for d in shape.split(":")) for shape in args.shapes.split(",")]
+    datasets = args.datasets.split(",")
+    names = list(OPTIONS) if args.options == "all" else args.options.split(",")
+    for name in names:
+        if name not in OPTIONS:
+            raise ValueError("Unknown options %r, expected one of %s" % (name, ", ".join(OPTIONS)))
+
+    cases = []
+    if "synthetic" in datasets:
+        for m, r in shapes:
+            for n in sizes:
+                cases.append(("synthetic", n, lambda n=n, m=m, r=r: synthetic_data(n, m, r, args.seed)))
+    if "eji" in datasets:
+        if os.path.exists("CDC_EJI_US.csv"):
+            for n, arrays in sorted(eji_data_sets(sizes, args.seed).items()):
+                cases.append(("eji", n, lambda arrays=arrays: arrays))
+        else:
+            print("CDC_EJI_US.csv not found, skipping the eji data set", file=sys.stderr)
+
+    results = []
+    for dataset, n, make in cases:
+        inputs, outputs = make()
+        for name in names:
+            options = {"formulation": args.formulation, "screen": args.screen}
+            options.update(OPTIONS[name])
+            measured, thetas = run_case(inputs, outputs, args.n_jobs, args.repeat, not args.no_memory, options)
+
+            # screening and partitions must not change the thetas of the model they screen for
+            max_abs_err = None
+            if n <= args.reference_max_n:
+                model, _ = split_options(options, n)
+                model.pop("formulation")
+                max_abs_err = float(np.abs(thetas - reference_thetas(inputs, outputs, **model)).max())
+
+            result = {"dataset": dataset, "n": n, "m": inputs.shape[1], "r": outputs.shape[1],
+                      "n_jobs": args.n_jobs, "options": name, "screen": options["screen"],
+                      "formulation": options["formulation"]}
+            result.update(measured)
+            result["max_abs_err"] = max_abs_err
+            result["accurate"] = None if max_abs_err is None else max_abs_err <= args.tolerance
+            results.append(result)
+
+            print("%-9s %-20s n=%-5d m=%-3d r=%-2d %9.3fs %8.3fms/unit  frontier=%-5d rss=%sMB err=%s" % (
+                dataset, name, n, result["m"], result["r"], result["wall_s"], result["wall_per_unit_ms"],
+                result["frontier_size"], "-" if result["peak_rss_mb"] is None else "%.0f" % result["peak_rss_mb"],
+                "-" if max_abs_err is None else "%.2e" % max_abs_err), file=sys.stderr)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "scipy": scipy.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    # a failed accuracy check fails the run
+    return 1 if any(result["accurate"] is False for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
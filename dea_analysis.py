@@ -1,47 +1,36 @@
 import pandas as pd
 import numpy as np
 import random
+import sys
 from envelopment import DEA  # Importing the DEA class from envelopment.py
-from measure_groups import dea_measures  # Importing measures from measure_groups.py
+import eji_data  # Columnar access to the EJI tract file
+import preprocessing  # Normalization of DEA inputs and outputs
+import instrumentation  # Timing diagnostics, on with EJI_PROFILE=1
 
-# Load the data
-data = pd.read_csv('CDC_EJI_US.csv')
+# Extract input and output measures from dea_measures
+input_measures, output_measures = eji_data.dea_columns()
 
-# Create a unique identifier for County and State combination
-data['County_State'] = data['COUNTY'] + ", " + data['StateDesc']
+# Load the data, only the columns needed for the DEA analysis, with the County_State identifier derived at load
+data = eji_data.load_tracts(columns=input_measures + output_measures)
+instrumentation.snapshot("dea_analysis.loaded")
 
 # Randomly select a few counties
 random.seed(42)  # For reproducibility
 selected_counties_states = random.sample(list(data['County_State'].unique()), 25)  # Select 5 random counties
 
-# Filter the data to only include the selected counties
-filtered_data = data[data['County_State'].isin(selected_counties_states)]
-
-# Extract input and output measures from dea_measures
-input_measures = []
-for category in dea_measures["inputs"].values():
-    input_measures.extend(category.keys())
-
-output_measures = []
-for category in dea_measures["outputs"].values():
-    output_measures.extend(category.keys())
-
 # Select only the columns that are needed for the DEA analysis
 columns_to_average = input_measures + output_measures
 
-# Average the input and output measures for each DMU (county_state)
-grouped_data = filtered_data.groupby('County_State')[columns_to_average].mean()
-
-# Replace zeros with a small positive value
-grouped_data.replace(0, 1e-6, inplace=True)
+# Average the input and output measures for each DMU (county_state), grouped on the County_State codes
+county_index = eji_data.CountyIndex(data, columns_to_average)
+county_means = pd.DataFrame(county_index.means, index=county_index.names, columns=columns_to_average)
+grouped_data = county_means.loc[sorted(selected_counties_states)]
 
-# Verify and normalize input/output measures
-for col in columns_to_average:
-    grouped_data[col] = grouped_data[col].apply(lambda x: max(1e-6, min(1, x / 100.0)))
+# Normalize input/output measures to (0, 1], zeros and negatives floored at a small positive value
+grouped_data = preprocessing.normalize_frame(grouped_data, columns_to_average)
 
 # Extract the input and output data after normalization
-input_data = grouped_data[input_measures].values
-output_data = grouped_data[output_measures].values
+input_data, output_data = preprocessing.dea_arrays(grouped_data, input_measures, output_measures)
 dmu_labels = grouped_data.index.values
 
 # Perform DEA using the custom DEA class
@@ -64,9 +53,8 @@ print(efficiency_df.to_string(index=False))
 
 # 2. Reference Sets
 print("\nReference Sets:")
-reference_sets = dea.lambdas
 for i, dmu in enumerate(dmu_labels):
-    references = [dmu_labels[j] for j in range(len(dmu_labels)) if reference_sets[j] > 0]
+    references = [dmu_labels[j] for j in dea.peers(i) if j != i]
     print(f"{dmu}: {', '.join(references) if references else 'No references (efficient)'}")
 
 # 3. Summary of Results
@@ -75,3 +63,8 @@ num_inefficient = len(dmu_labels) - num_efficient
 print("\nSummary of DEA Results:")
 print(f"Number of Efficient DMUs: {num_efficient}")
 print(f"Number of Inefficient DMUs: {num_inefficient}")
+
+# Timings, counters and memory snapshots as JSON lines on stderr, when profiling is on
+if instrumentation.enabled():
+    instrumentation.snapshot("dea_analysis.done")
+    instrumentation.export(sys.stderr)
@@ -0,0 +1,245 @@
+"""
+Precomputed DEA results for the standard county groupings
+
+A build step fits the national set and every state (see dea_batch) once per dataset version and
+dea_measures config, and stores all groups in one set of flat .npy arrays. The pages memory-map them
+at startup, so a standard selection is served without solving and without reading the arrays into
+each process; ad-hoc selections still solve live.
+
+Usage:
+    python dea_artifacts.py --n-jobs 8
+
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+from scipy import sparse
+
+import dea_batch
+import eji_data
+import preprocessing
+import utils
+
+ARTIFACT_DIR = "dea_artifacts"
+
+ARRAYS = ("efficiency", "input_w", "output_w", "units", "lambdas_data", "lambdas_indices", "lambdas_indptr")
+
+
+def artifact_key(data_version, input_measures, output_measures, scaling="percentile"):
+    """
+    Key of the artifacts of one dataset version and measures config
+    :param data_version: see eji_data.dataset_version
+    :param input_measures: input columns, in model order
+    :param output_measures: output columns, in model order
+    :param scaling: normalization, one of preprocessing.SCALINGS
+    :return: hex digest
+    """
+
+    content = json.dumps({"data_version": data_version, "inputs": list(input_measures),
+                          "outputs": list(output_measures), "scaling": scaling}, sort_keys=True)
+
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def group_key(labels):
+    """
+    Key of a selection of counties, independent of their order
+    :param labels: "County, State" labels
+    :return: hex digest
+    """
+
+    return hashlib.sha256("\n".join(sorted(str(label) for label in labels)).encode("utf-8")).hexdigest()
+
+
+class DEAArtifacts(object):
+
+    def __init__(self, path):
+        """
+        Memory-map the artifacts in a directory written by build
+        :param path: artifact directory
+        :return: self
+        """
+
+        with open(os.path.join(path, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        self.names = np.load(os.path.join(path, "names.npy"), mmap_mode="r")
+        self.arrays = {name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r") for name in ARRAYS}
+
+        # units offset:offset+count of the stacked arrays belong to group i
+        self.groups = self.manifest["groups"]
+        self.__lookup = {group["key"]: i for i, group in enumerate(self.groups)}
+
+    def lookup(self, labels):
+        """
+        Precomputed results of a selection, when it is one of the standard groups
+        :param labels: "County, State" labels, in any order
+        :return: results dict (see DEA.results) in the group's unit order, or None
+        """
+
+        i = self.__lookup.get(group_key(labels))
+        if i is None:
+            return None
+
+        return self.results(i)
+
+    def results(self, i):
+        """
+        Precomputed results of one group
+        :param i: group position in self.groups
+        :return: results dict (see DEA.results)
+        """
+
+        group = self.groups[i]
+        units = slice(group["offset"], group["offset"] + group["count"])
+        indptr = np.asarray(self.arrays["lambdas_indptr"][group["offset"]:group["offset"] + group["count"] + 1])
+        data = slice(indptr[0], indptr[-1])
+        lambdas = sparse.csr_matrix((self.arrays["lambdas_data"][data], self.arrays["lambdas_indices"][data],
+                                     indptr - indptr[0]), shape=(group["count"], group["count"]))
+
+        return {"names": self.names[self.arrays["units"][units]].tolist(),
+                "efficiency": self.arrays["efficiency"][units],
+                "lambdas": lambdas,
+                "input_w": self.arrays["input_w"][units],
+                "output_w": self.arrays["output_w"][units]}
+
+    def labels(self, i):
+        """
+        County labels of one group, in unit order
+        :param i: group position in self.groups
+        :return: list of labels
+        """
+
+        group = self.groups[i]
+
+        return self.names[self.arrays["units"][group["offset"]:group["offset"] + group["count"]]].tolist()
+
+
+def build_stamp(data_version, input_measures, output_measures, scaling="percentile", directory=ARTIFACT_DIR):
+    """
+    Modification time of the artifacts of a dataset version and measures config, changes with every build
+    :param data_version: see eji_data.dataset_version
+    :param input_measures: input columns
+    :param output_measures: output columns
+    :param scaling: normalization, one of preprocessing.SCALINGS
+    :param directory: artifact root directory
+    :return: float, or None when they were not built
+    """
+
+    path = os.path.join(directory, artifact_key(data_version, input_measures, output_measures, scaling))
+    try:
+        return os.path.getmtime(os.path.join(path, "manifest.json"))
+    except OSError:
+        return None
+
+
+def load(data_version, input_measures, output_measures, scaling="percentile", directory=ARTIFACT_DIR):
+    """
+    Artifacts of a dataset version and measures config
+    :param data_version: see eji_data.dataset_version
+    :param input_measures: input columns
+    :param output_measures: output columns
+    :param scaling: normalization, one of preprocessing.SCALINGS
+    :param directory: artifact root directory
+    :return: DEAArtifacts, or None when they were not built
+    """
+
+    path = os.path.join(directory, artifact_key(data_version, input_measures, output_measures, scaling))
+    if not os.path.exists(os.path.join(path, "manifest.json")):
+        return None
+
+    return DEAArtifacts(path)
+
+
+def build(directory=ARTIFACT_DIR, scopes=("national", "state"), scaling="percentile", n_jobs=-1):
+    """
+    Fit the standard groupings of the current dataset and write their artifacts
+    :param directory: artifact root directory
+    :param scopes: dea_batch scopes to precompute
+    :param scaling: normalization, one of preprocessing.SCALINGS
+    :param n_jobs: worker processes, -1 for all cores
+    :return: artifact directory
+    """
+
+    n_jobs = utils.worker_count(n_jobs)
+
+    input_measures, output_measures = eji_data.dea_columns()
+    columns = input_measures + output_measures
+    counties = eji_data.county_table()
+    normalized = preprocessing.normalize_frame(counties, columns, scaling)
+
+    def arrays(labels):
+        return preprocessing.dea_arrays(normalized.loc[labels], input_measures, output_measures)
+
+    def partitions(labels):
+        return dea_batch.state_partitions(counties, labels)
+
+    # fit, then stack the groups in problem order
+    batch = dea_batch.problems(counties, scopes)
+    fitted = {}
+    for problem, dea in dea_batch.solve_all(batch, arrays, n_jobs, partitions=partitions):
+        fitted[problem[:2]] = dea
+        print("%-8s %-30s n=%-5d" % (problem[0], problem[1], len(problem[2])), file=sys.stderr)
+
+    groups, stacked = [], {name: [] for name in ARRAYS}
+    offset, nnz = 0, 0
+    for scope, group, labels in batch:
+        dea = fitted[(scope, group)]
+        lambdas = sparse.csr_matrix(dea.lambdas)
+        groups.append({"scope": scope, "group": group, "key": group_key(labels), "offset": offset,
+                       "count": len(labels)})
+        stacked["efficiency"].append(dea.efficiency[:, 0])
+        stacked["input_w"].append(dea.input_w)
+        stacked["output_w"].append(dea.output_w)
+        stacked["units"].append(counties.index.get_indexer(labels))
+        stacked["lambdas_data"].append(lambdas.data)
+        stacked["lambdas_indices"].append(lambdas.indices)
+        stacked["lambdas_indptr"].append(lambdas.indptr[:-1] + nnz)
+        offset += len(labels)
+        nnz += lambdas.nnz
+    stacked["lambdas_indptr"].append([nnz])
+
+    # build next to the target and swap the directory in, readers only ever see a complete directory or
+    # none at all (the pages retry a missing one), and memory maps of the old build stay valid
+    key = artifact_key(eji_data.dataset_version(), input_measures, output_measures, scaling)
+    path = os.path.join(directory, key)
+    with utils.atomic_path(path) as tmp:
+        os.makedirs(tmp)
+        np.save(os.path.join(tmp, "names.npy"), np.asarray(counties.index, dtype=str))
+        np.save(os.path.join(tmp, "efficiency.npy"), np.concatenate(stacked["efficiency"]).reshape(-1, 1))
+        np.save(os.path.join(tmp, "units.npy"), np.concatenate(stacked["units"]).astype(np.int32))
+        np.save(os.path.join(tmp, "lambdas_indptr.npy"),
+                np.concatenate(stacked["lambdas_indptr"]).astype(np.int64))
+        for name in ("input_w", "output_w", "lambdas_data", "lambdas_indices"):
+            np.save(os.path.join(tmp, name + ".npy"), np.concatenate(stacked[name]))
+        with open(os.path.join(tmp, "manifest.json"), "w") as f:
+            json.dump({"data_version": eji_data.dataset_version(), "inputs": input_measures,
+                       "outputs": output_measures, "scaling": scaling, "groups": groups}, f, indent=1)
+
+    return path
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Precompute DEA results of the standard county groupings")
+    parser.add_argument("--scopes", default="national,state", help="comma-separated scopes: national, state")
+    parser.add_argument("--scaling", default="percentile", choices=preprocessing.SCALINGS,
+                        help="normalization of the measures")
+    parser.add_argument("--n-jobs", type=int, default=-1, help="worker processes, -1 for all cores")
+    parser.add_argument("--directory", default=ARTIFACT_DIR, help="artifact root directory")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    path = build(args.directory, args.scopes.split(","), args.scaling, args.n_jobs)
+    print("wrote %s" % path, file=sys.stderr)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,310 @@
+"""
+Batch DEA over the whole county or tract table
+
+Scores every county nationally, every county within its own state and any custom groups of counties,
+each group as its own DEA problem. Small problems are spread over a process pool, large ones are solved
+one at a time with the pool inside DEA.fit, their frontier screened state by state (see
+envelopment.partition_frontier). Each finished problem is checkpointed to its own Parquet part, and
+inside a large problem the screened frontier and every finished chunk of units are checkpointed as well
+(see DEA.fit), so a killed run picks up where it stopped, even halfway through the national problem.
+Bootstrap replications are not checkpointed and start over. The parts are merged into one Parquet file
+of efficiencies, peers and weights.
+
+With --level tract every tract is its own unit instead of being averaged into its county, so the
+disparities within a county stay visible.
+
+Usage:
+    python dea_batch.py --scopes national,state --groups groups.json --n-jobs 8 --output dea_results.parquet
+    python dea_batch.py --level tract --scopes national --n-jobs 8 --output dea_tracts.parquet
+
+groups.json maps a group name to a list of "County, State" labels (tract GEOIDs with --level tract).
+
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+import eji_data
+import preprocessing
+import utils
+from envelopment import DEA
+
+SCOPES = ("national", "state", "group")
+LEVELS = ("county", "tract")
+
+# problems with at least this many units get the whole pool and frontier screening to themselves
+LARGE_PROBLEM = 500
+
+
+def problems(units, scopes, groups=None):
+    """
+    DEA problems of a batch run
+    :param units: county or tract table, see eji_data.county_table and eji_data.tract_table
+    :param scopes: any of SCOPES
+    :param groups: dict of custom group name to unit labels, for the group scope
+    :return: list of (scope, group, labels)
+    """
+
+    for scope in scopes:
+        if scope not in SCOPES:
+            raise ValueError("Unknown scope %r, expected one of %s" % (scope, ", ".join(SCOPES)))
+
+    batch = []
+    if "national" in scopes:
+        batch.append(("national", "United States", list(units.index)))
+    if "state" in scopes:
+        states = units["StateDesc"].cat
+        for code, state in enumerate(states.categories):
+            labels = list(units.index[states.codes.to_numpy() == code])
+            if len(labels) > 0:
+                batch.append(("state", str(state), labels))
+    if "group" in scopes:
+        for group, labels in sorted((groups or {}).items()):
+            unknown = [label for label in labels if label not in units.index]
+            if unknown:
+                raise ValueError("Group %r has unknown units: %s" % (group, ", ".join(map(str, unknown[:5]))))
+            batch.append(("group", group, list(labels)))
+
+    return batch
+
+
+def state_partitions(units, labels):
+    """
+    Units of a problem grouped by state, for the partitioned frontier screening of large problems
+    :param units: county or tract table
+    :param labels: unit labels of the problem, in unit order
+    :return: list of unit index arrays, None when the problem lies within one state
+    """
+
+    codes = units["StateDesc"].cat.codes.to_numpy()[units.index.get_indexer(labels)]
+    states = np.unique(codes)
+    if len(states) < 2:
+        return None
+
+    return [np.flatnonzero(codes == code) for code in states]
+
+
+def part_path(directory, scope, group, labels, config):
+    """
+    Checkpoint file of one problem, named after its content so a changed group or config is solved again
+    :param directory: checkpoint directory
+    :param scope: problem scope
+    :param group: group name
+    :param labels: county labels of the problem
+    :param config: run settings the results depend on
+    :return: path
+    """
+
+    content = json.dumps({"scope": scope, "group": group, "labels": sorted(labels), "config": config},
+                         sort_keys=True, default=str)
+    digest = hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", group).strip("_")
+
+    return os.path.join(directory, "%s--%s--%s.parquet" % (scope, slug, digest))
+
+
+def fit(labels, inputs, outputs, n_jobs=1, screen=False, bootstrap=0, seed=0, partitions=None, checkpoint=None):
+    """
+    Fit one problem
+    :param labels: unit labels, in unit order
+    :param inputs: inputs, n x m numpy array
+    :param outputs: outputs, n x r numpy array
+    :param n_jobs: worker processes passed to DEA.fit
+    :param screen: pre-screen the frontier in DEA.fit
+    :param bootstrap: bootstrap replications for confidence intervals (DEA.bootstrap), 0 for none
+    :param seed: bootstrap random seed
+    :param partitions: screen the frontier partition by partition in DEA.fit, e.g. by state
+    :param checkpoint: directory of the screened frontier and finished chunks of units, see DEA.fit
+    :return: fitted DEA
+    """
+
+    dea = DEA(inputs, outputs)
+    dea.name_units(labels)
+    dea.fit(n_jobs=n_jobs, screen=screen, verbose=False, partitions=partitions, checkpoint=checkpoint)
+    if bootstrap > 0:
+        dea.bootstrap(bootstrap, n_jobs=n_jobs, seed=seed)
+
+    return dea
+
+
+def solve_all(batch, arrays, n_jobs, bootstrap=0, seed=0, partitions=None, checkpoints=None):
+    """
+    Fit many problems, large ones one at a time on the whole pool and small ones spread over it
+    :param batch: list of problems, tuples starting with (scope, group, labels)
+    :param arrays: called as arrays(labels), returns the inputs and outputs of a problem
+    :param n_jobs: worker processes
+    :param bootstrap: bootstrap replications per problem, 0 for none
+    :param seed: bootstrap random seed
+    :param partitions: called as partitions(labels), returns the screening partitions of a large problem
+        or None, see state_partitions
+    :param checkpoints: called as checkpoints(problem), returns the checkpoint directory of a large problem
+        or None, see DEA.fit
+    :return: generator of (problem, fitted DEA) in completion order
+    """
+
+    for problem in [problem for problem in batch if len(problem[2]) >= LARGE_PROBLEM]:
+        inputs, outputs = arrays(problem[2])
+        yield problem, fit(problem[2], inputs, outputs, n_jobs=n_jobs, screen=True, bootstrap=bootstrap,
+                           seed=seed, partitions=None if partitions is None else partitions(problem[2]),
+                           checkpoint=None if checkpoints is None else checkpoints(problem))
+
+    small = [problem for problem in batch if len(problem[2]) < LARGE_PROBLEM]
+    if small:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            futures = {pool.submit(fit, problem[2], *arrays(problem[2]), bootstrap=bootstrap, seed=seed): problem
+                       for problem in small}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+
+def flatten(scope, group, dea, input_measures, output_measures, label=eji_data.COUNTY_STATE):
+    """
+    Results of one problem, one row per unit, with the weights and the gaps to the frontier targets
+    :param scope: problem scope
+    :param group: group name
+    :param dea: fitted DEA, with the unit labels as names
+    :param input_measures: input columns, for the weight column names
+    :param output_measures: output columns, for the weight column names
+    :param label: name of the unit label column
+    :return: DataFrame
+    """
+
+    # peers and their lambdas straight from the CSR rows
+    labels = list(dea.names)
+    lambdas = dea.lambdas
+    names = np.asarray(labels, dtype=object)
+    peers = [list(names[lambdas.indices[start:end]]) for start, end in zip(lambdas.indptr[:-1], lambdas.indptr[1:])]
+    peer_lambdas = [list(lambdas.data[start:end]) for start, end in zip(lambdas.indptr[:-1], lambdas.indptr[1:])]
+
+    results = pd.DataFrame({
+        "scope": scope,
+        "group": group,
+        label: labels,
+        "n_units": len(labels),
+        "efficiency": dea.efficiency[:, 0],
+        "efficient": np.isin(np.arange(dea.n), dea.frontier),
+        "peers": peers,
+        "peer_lambdas": peer_lambdas,
+    })
+    if dea.intervals is not None:
+        for column in ("bias_corrected", "std", "lower", "upper"):
+            results["bootstrap_" + column] = dea.intervals[column]
+    weights = pd.DataFrame(np.hstack([dea.input_w, dea.output_w]),
+                           columns=["input_w_" + column for column in input_measures] +
+                                   ["output_w_" + column for column in output_measures])
+    targets = dea.targets()
+    gaps = pd.DataFrame(np.hstack([targets["input_gaps"], targets["output_gaps"]]),
+                        columns=["input_gap_" + column for column in input_measures] +
+                                ["output_gap_" + column for column in output_measures])
+
+    return pd.concat([results, weights, gaps], axis=1)
+
+
+def write_parquet(frame, path):
+    """
+    Write a frame atomically, a killed run never leaves a partial file behind
+    :param frame: DataFrame
+    :param path: target path
+    :return: nothing
+    """
+
+    with utils.atomic_path(path) as tmp:
+        frame.to_parquet(tmp, index=False)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Batch DEA of the EJI counties or tracts")
+    parser.add_argument("--level", default="county", choices=LEVELS,
+                        help="unit of analysis: counties (tract means) or every tract on its own")
+    parser.add_argument("--scopes", default="national,state",
+                        help="comma-separated scopes: national, state, group (with --groups)")
+    parser.add_argument("--groups", default=None, help="JSON file of custom group name -> county labels")
+    parser.add_argument("--scaling", default="percentile", choices=preprocessing.SCALINGS,
+                        help="normalization of the measures")
+    parser.add_argument("--n-jobs", type=int, default=-1, help="worker processes, -1 for all cores")
+    parser.add_argument("--bootstrap", type=int, default=0,
+                        help="bootstrap replications for bias-corrected scores and 95%% intervals, 0 for none")
+    parser.add_argument("--seed", type=int, default=0, help="bootstrap random seed")
+    parser.add_argument("--output", default="dea_results.parquet", help="merged Parquet output")
+    parser.add_argument("--checkpoints", default=None,
+                        help="directory of per-problem checkpoints, <output>.parts by default")
+    parser.add_argument("--restart", action="store_true", help="discard existing checkpoints first")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    scopes = args.scopes.split(",")
+    groups = None
+    if args.groups is not None:
+        with open(args.groups) as f:
+            groups = json.load(f)
+        if "group" not in scopes:
+            scopes.append("group")
+    n_jobs = utils.worker_count(args.n_jobs)
+    checkpoints = args.checkpoints or args.output + ".parts"
+
+    input_measures, output_measures = eji_data.dea_columns()
+    columns = input_measures + output_measures
+    if args.level == "tract":
+        units = eji_data.tract_table(columns)
+        label, id_columns = eji_data.TRACT_ID, [eji_data.COUNTY_STATE] + eji_data.ID_COLUMNS
+    else:
+        units = eji_data.county_table()
+        label, id_columns = eji_data.COUNTY_STATE, eji_data.ID_COLUMNS
+    normalized = preprocessing.normalize_frame(units, columns, args.scaling)
+    config = {"data_version": eji_data.dataset_version(), "level": args.level, "inputs": input_measures,
+              "outputs": output_measures, "scaling": args.scaling, "bootstrap": args.bootstrap, "seed": args.seed}
+
+    if args.restart and os.path.isdir(checkpoints):
+        shutil.rmtree(checkpoints)
+    os.makedirs(checkpoints, exist_ok=True)
+
+    # problems with a checkpoint from an earlier run are not solved again
+    batch = [(scope, group, labels, part_path(checkpoints, scope, group, labels, config))
+             for scope, group, labels in problems(units, scopes, groups)]
+    todo = [problem for problem in batch if not os.path.exists(problem[3])]
+    print("%d problems, %d checkpointed, %d to solve" % (len(batch), len(batch) - len(todo), len(todo)),
+          file=sys.stderr)
+
+    def arrays(labels):
+        return preprocessing.dea_arrays(normalized.loc[labels], input_measures, output_measures)
+
+    def partitions(labels):
+        return state_partitions(units, labels)
+
+    def chunks(problem):
+        return problem[3] + ".chunks"
+
+    start = time.perf_counter()
+    for (scope, group, labels, path), dea in solve_all(todo, arrays, n_jobs, args.bootstrap, args.seed, partitions,
+                                                       chunks):
+        write_parquet(flatten(scope, group, dea, input_measures, output_measures, label), path)
+        # the finished part supersedes the chunks it was solved from
+        shutil.rmtree(path + ".chunks", ignore_errors=True)
+        print("%-8s %-30s n=%-5d %8.1fs" % (scope, group, len(labels), time.perf_counter() - start),
+              file=sys.stderr)
+
+    # merge the parts of this run, with the county and state names next to each label
+    results = pd.concat([pd.read_parquet(path) for _, _, _, path in batch], ignore_index=True)
+    ids = units[id_columns].reindex(results[label])
+    for position, column in enumerate(id_columns):
+        results.insert(3 + position, column, ids[column].array)
+    write_parquet(results, args.output)
+    print("wrote %d rows to %s" % (len(results), args.output), file=sys.stderr)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
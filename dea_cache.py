@@ -0,0 +1,174 @@
+"""
+Content-addressed cache for DEA results
+
+Results are keyed by a hash of the sorted DMU list, the input/output measure columns and the
+solver options, and kept in a small in-memory LRU backed by an on-disk tier of .npz files,
+so repeated analyses are served without solving across sessions and server restarts.
+
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import zipfile
+from collections import OrderedDict
+
+import numpy as np
+from scipy import sparse
+
+import utils
+
+logger = logging.getLogger("eji.dea_cache")
+
+
+class DEACache(object):
+
+    def __init__(self, directory=".dea_cache", max_entries=64, max_disk_entries=1024):
+        """
+        Initialize the cache
+        :param directory: directory of the on-disk tier, None to keep results in memory only
+        :param max_entries: results kept in memory
+        :param max_disk_entries: results kept on disk
+        :return: self
+        """
+
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+
+        self._memory = OrderedDict()
+        self._writing = set()
+        self._lock = threading.Lock()
+
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(dmus, input_measures, output_measures, **options):
+        """
+        Cache key of one DEA run
+        :param dmus: DMU labels, in any order
+        :param input_measures: input measure columns, in model order
+        :param output_measures: output measure columns, in model order
+        :param options: solver options and anything else the results depend on (e.g. data_version)
+        :return: hex digest
+        """
+
+        content = json.dumps({
+            "dmus": sorted(str(dmu) for dmu in dmus),
+            "inputs": list(input_measures),
+            "outputs": list(output_measures),
+            "options": options,
+        }, sort_keys=True, default=str)
+
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        Look up a result, in memory first and then on disk
+        :param key: cache key
+        :return: results dict (see DEA.results) or None
+        """
+
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+
+        results = self._read(key)
+        if results is not None:
+            self._remember(key, results)
+
+        return results
+
+    def put(self, key, results):
+        """
+        Store a result in both tiers; a failed disk write is logged, the result stays cached in memory
+        :param key: cache key
+        :param results: results dict, see DEA.results
+        :return: nothing
+        """
+
+        self._remember(key, results)
+        try:
+            self._write(key, results)
+        except Exception:
+            logger.warning("could not write DEA result %s to %s", key, self.directory, exc_info=True)
+
+    def _remember(self, key, results):
+        """
+        Insert into the memory tier, evicting the least recently used results
+        """
+
+        with self._lock:
+            self._memory[key] = results
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def _read(self, key):
+        """
+        Load a result from the disk tier, marking it as recently used
+        """
+
+        if self.directory is None or not os.path.exists(self._path(key)):
+            return None
+
+        try:
+            with np.load(self._path(key), allow_pickle=False) as stored:
+                lambdas = sparse.csr_matrix((stored["lambdas_data"], stored["lambdas_indices"],
+                                             stored["lambdas_indptr"]), shape=tuple(stored["lambdas_shape"]))
+                results = {"names": stored["names"].tolist(), "efficiency": stored["efficiency"],
+                           "lambdas": lambdas, "input_w": stored["input_w"], "output_w": stored["output_w"]}
+            os.utime(self._path(key))
+        except FileNotFoundError:
+            # evicted meanwhile, treat as a miss
+            return None
+        except (OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile):
+            # truncated or corrupt, drop it and treat as a miss
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+            return None
+
+        return results
+
+    def _write(self, key, results):
+        """
+        Store a result in the disk tier, evicting the least recently used files
+        """
+
+        if self.directory is None:
+            return
+
+        # sessions finishing the same selection write the same content, one writer per key is enough
+        with self._lock:
+            if key in self._writing:
+                return
+            self._writing.add(key)
+        try:
+            lambdas = sparse.csr_matrix(results["lambdas"])
+            with utils.atomic_path(self._path(key)) as tmp, open(tmp, "wb") as f:
+                np.savez_compressed(f, names=np.asarray(results["names"], dtype=str),
+                                    efficiency=results["efficiency"], input_w=results["input_w"],
+                                    output_w=results["output_w"], lambdas_data=lambdas.data,
+                                    lambdas_indices=lambdas.indices, lambdas_indptr=lambdas.indptr,
+                                    lambdas_shape=np.asarray(lambdas.shape))
+        finally:
+            with self._lock:
+                self._writing.discard(key)
+
+        files = [os.path.join(self.directory, f) for f in os.listdir(self.directory) if f.endswith(".npz")]
+        if len(files) > self.max_disk_entries:
+            files.sort(key=os.path.getmtime)
+            for f in files[:len(files) - self.max_disk_entries]:
+                try:
+                    os.remove(f)
+                except OSError:
+                    pass
@@ -0,0 +1,139 @@
+"""
+Background DEA jobs for the Streamlit pages
+
+A DEAJob runs one fit or update on a shared, bounded thread pool while the page polls it for progress and
+partial scores. Timings of the solve are collected in the worker thread when the submitting run collects
+them, and handed back with the result (instrumentation keeps its records per thread). The job doubles as the cancel token handed to the solver: it reads as set once cancelled
+or once nobody has polled it for a while, so superseded jobs and jobs of closed sessions stop on their own.
+
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import instrumentation
+from envelopment import FitCancelled
+
+# worker threads shared by all sessions
+MAX_WORKERS = 2
+
+# a job nobody polled for this many seconds is abandoned
+ABANDON_AFTER = 30.0
+
+
+def executor(max_workers=MAX_WORKERS):
+    """
+    Thread pool to run jobs on, one per server process (the pages share it through st.cache_resource)
+    :param max_workers: jobs running at the same time
+    :return: ThreadPoolExecutor
+    """
+
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dea-job")
+
+
+class DEAJob(object):
+
+    def __init__(self, solve, names, abandon_after=ABANDON_AFTER):
+        """
+        A DEA solve to run in the background
+        :param solve: called as solve(progress, cancel) in the worker thread, returns the fitted DEA;
+            progress and cancel are passed on to DEA.fit or DEA.update
+        :param names: unit names in the order of the fitted DEA's units, for partial results
+        :param abandon_after: seconds without a poll after which the job cancels itself
+        :return: self
+        """
+
+        self.names = list(names)
+        self.total = len(self.names)
+        self.result = None
+        self.error = None
+        self.records = []  # instrumentation records of the solve, see run
+        self.abandon_after = abandon_after
+        self.profile = instrumentation.enabled()
+
+        self.__solve = solve
+        self.__scores = {}
+        self.__lock = threading.Lock()
+        self.__cancelled = threading.Event()
+        self.__done = threading.Event()
+        self.__polled = time.monotonic()
+
+    def __progress(self, unit, theta):
+        with self.__lock:
+            self.__scores[int(unit)] = float(theta)
+
+    def run(self):
+        """
+        Run the solve, called by the executor
+        :return: nothing
+        """
+
+        instrumentation.start_run(self.profile)
+        try:
+            if not self.is_set():
+                self.result = self.__solve(self.__progress, self)
+        except FitCancelled:
+            pass
+        except Exception as e:
+            self.error = e
+        finally:
+            # hand the records over and leave the pool thread's collection empty
+            self.records = instrumentation.records()
+            instrumentation.start_run()
+            self.__done.set()
+
+    def submit(self, pool):
+        """
+        Queue the job on a thread pool
+        :param pool: executor, see executor()
+        :return: self
+        """
+
+        pool.submit(self.run)
+
+        return self
+
+    def poll(self):
+        """
+        Scores of the units solved so far, keeping the job alive
+        :return: dict of unit name to theta
+        """
+
+        self.__polled = time.monotonic()
+        with self.__lock:
+            scores = dict(self.__scores)
+
+        return {self.names[unit]: theta for unit, theta in scores.items()}
+
+    def cancel(self):
+        """
+        Ask the job to stop, it stops before its next unit
+        :return: nothing
+        """
+
+        self.__cancelled.set()
+
+    def is_set(self):
+        """
+        Cancel token for the solver: cancelled, or abandoned by its page
+        :return: bool
+        """
+
+        return self.__cancelled.is_set() or time.monotonic() - self.__polled > self.abandon_after
+
+    def cancelled(self):
+        """
+        Whether the job stopped without a result because it was cancelled or abandoned
+        :return: bool
+        """
+
+        return self.__done.is_set() and self.result is None and self.error is None
+
+    def done(self):
+        """
+        Whether the job finished, with a result, an error or cancelled
+        :return: bool
+        """
+
+        return self.__done.is_set()
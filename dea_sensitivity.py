@@ -0,0 +1,123 @@
+"""
+Measure sensitivity of the county DEA scores
+
+Reruns the DEA for every leave-one-measure-out and leave-one-category-out variant of dea_measures,
+so an analyst can see whether a county's score hinges on a single measure such as EPL_RENTER. The
+measures are normalized once for all variants and the variants are solved together on one process
+pool (see DEA.sensitivity). The result is one Parquet table of counties x variants.
+
+Usage:
+    python dea_sensitivity.py --n-jobs 8 --output dea_sensitivity.parquet
+    python dea_sensitivity.py --state "New Mexico" --output dea_sensitivity_nm.parquet
+
+"""
+
+import argparse
+import sys
+import time
+
+import pandas as pd
+
+import dea_batch
+import eji_data
+import preprocessing
+import utils
+from envelopment import DEA
+from measure_groups import dea_measures
+
+BASELINE = "all measures"
+
+
+def variants(measures=dea_measures):
+    """
+    Measure selections of the sweep: all measures, each measure left out, each category left out;
+    selections without an input or an output are skipped
+    :param measures: dict like dea_measures, inputs and outputs by category
+    :return: list of (name, input columns, output columns)
+    """
+
+    input_measures = [column for category in measures["inputs"].values() for column in category]
+    output_measures = [column for category in measures["outputs"].values() for column in category]
+
+    dropped = [(BASELINE, [])]
+    dropped.extend(("without %s" % column, [column]) for column in input_measures + output_measures)
+    for side in ("inputs", "outputs"):
+        for category, columns in measures[side].items():
+            dropped.append(("without %s" % category, list(columns)))
+
+    selections = []
+    for name, columns in dropped:
+        inputs = [column for column in input_measures if column not in columns]
+        outputs = [column for column in output_measures if column not in columns]
+        if inputs and outputs:
+            selections.append((name, inputs, outputs))
+
+    return selections
+
+
+def sweep(frame, selections, scaling="percentile", n_jobs=1, screen=False):
+    """
+    Scores of every unit under every measure selection
+    :param frame: units x measures DataFrame, e.g. the county table
+    :param selections: list of (name, input columns, output columns), see variants
+    :param scaling: normalization, one of preprocessing.SCALINGS
+    :param n_jobs: worker processes, -1 for all cores
+    :param screen: screen each variant's frontier before scoring, pays off for large unit counts
+    :return: DataFrame of thetas, units x variants
+    """
+
+    # one normalization and one set of arrays shared by every variant
+    input_measures = list(dict.fromkeys(column for _, inputs, _ in selections for column in inputs))
+    output_measures = list(dict.fromkeys(column for _, _, outputs in selections for column in outputs))
+    normalized = preprocessing.normalize_frame(frame, input_measures + output_measures, scaling)
+    inputs, outputs = preprocessing.dea_arrays(normalized, input_measures, output_measures)
+
+    dea = DEA(inputs, outputs)
+    thetas = dea.sensitivity([([input_measures.index(column) for column in selected_inputs],
+                               [output_measures.index(column) for column in selected_outputs])
+                              for _, selected_inputs, selected_outputs in selections], n_jobs=n_jobs, screen=screen)
+
+    return pd.DataFrame(thetas, index=frame.index, columns=[name for name, _, _ in selections])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Leave-one-out measure sensitivity of the county DEA scores")
+    parser.add_argument("--state", default=None, help="only the counties of this state, all counties by default")
+    parser.add_argument("--scaling", default="percentile", choices=preprocessing.SCALINGS,
+                        help="normalization of the measures")
+    parser.add_argument("--n-jobs", type=int, default=-1, help="worker processes, -1 for all cores")
+    parser.add_argument("--output", default="dea_sensitivity.parquet", help="Parquet output")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    n_jobs = utils.worker_count(args.n_jobs)
+
+    counties = eji_data.county_table()
+    if args.state is not None:
+        counties = counties[eji_data.category_mask(counties["StateDesc"], [args.state])]
+        if len(counties) == 0:
+            raise ValueError("No counties in state %r" % args.state)
+
+    selections = variants()
+    start = time.perf_counter()
+    thetas = sweep(counties, selections, args.scaling, n_jobs, screen=len(counties) >= 500)
+    print("%d counties x %d variants in %.1fs" % (thetas.shape[0], thetas.shape[1], time.perf_counter() - start),
+          file=sys.stderr)
+
+    # leaving measures out can only lower the scores, the largest mean drop marks the most influential ones
+    changes = thetas.drop(columns=BASELINE).sub(thetas[BASELINE], axis=0).mean()
+    print("largest mean score change: %s (%+.4f)" % (changes.idxmin(), changes.min()), file=sys.stderr)
+
+    results = thetas.reset_index()
+    for position, column in enumerate(eji_data.ID_COLUMNS):
+        results.insert(1 + position, column, counties[column].array)
+    dea_batch.write_parquet(results, args.output)
+    print("wrote %d rows to %s" % (len(results), args.output), file=sys.stderr)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,296 @@
+"""
+Data access for the CDC EJI tract file
+
+The national CSV is converted once into a Parquet file with an explicit dtype schema, after which
+callers load only the columns they need instead of parsing every column of every tract.
+Falls back to a column-projected CSV read when pyarrow is not installed.
+
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+import instrumentation
+import utils
+from measure_groups import dea_measures, eji_percentile_measures
+
+CSV_PATH = 'CDC_EJI_US.csv'
+PARQUET_PATH = 'CDC_EJI_US.parquet'
+
+# identifier columns used by the pages
+ID_COLUMNS = ["COUNTY", "StateDesc"]
+POPULATION_COLUMN = "E_TOTPOP"
+TRACT_ID = "GEOID"
+
+# derived columns
+COUNTY_STATE = "County_State"
+TRACT_COUNT = "TRACT_COUNT"
+
+
+def dea_columns():
+    """
+    Input and output measure columns of the DEA model, in model order
+    :return: list of input columns, list of output columns
+    """
+
+    input_measures = []
+    for category in dea_measures["inputs"].values():
+        input_measures.extend(category.keys())
+
+    output_measures = []
+    for category in dea_measures["outputs"].values():
+        output_measures.extend(category.keys())
+
+    return input_measures, output_measures
+
+
+def percentile_columns():
+    """
+    All EJI percentile measure columns shown on the Risk Scorecard and County Comparison pages
+    :return: list of columns
+    """
+
+    columns = []
+    for measures in eji_percentile_measures.values():
+        columns.extend(measures.keys())
+
+    return columns
+
+
+def measure_columns():
+    """
+    Every measure in measure_groups, percentile measures first, without duplicates
+    :return: list of columns
+    """
+
+    input_measures, output_measures = dea_columns()
+
+    return list(dict.fromkeys(percentile_columns() + input_measures + output_measures))
+
+
+def schema():
+    """
+    Explicit dtypes of the columns the app uses; other columns keep the types inferred from the CSV.
+    County and state names are dictionary-encoded as categoricals.
+    :return: dict of column -> dtype
+    """
+
+    dtypes = {column: "category" for column in ID_COLUMNS}
+    dtypes[POPULATION_COLUMN] = "int64"
+    for column in measure_columns():
+        dtypes[column] = "float64"
+
+    return dtypes
+
+
+def dataset_version(path=CSV_PATH):
+    """
+    Version tag of the source CSV, changes whenever the file is replaced
+    :param path: CSV path
+    :return: string
+    """
+
+    stat = os.stat(path)
+
+    return "%d-%d" % (stat.st_size, stat.st_mtime)
+
+
+def _has_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def convert(csv_path=CSV_PATH, parquet_path=PARQUET_PATH):
+    """
+    Convert the CSV into Parquet once, applying the schema
+    :param csv_path: source CSV
+    :param parquet_path: Parquet file to write
+    :return: nothing
+    """
+
+    with instrumentation.span("eji_data.convert"):
+        header = pd.read_csv(csv_path, nrows=0).columns
+        dtypes = {column: dtype for column, dtype in schema().items() if column in header}
+        data = pd.read_csv(csv_path, dtype=dtypes)
+
+    # write next to the target and swap in, so concurrent readers never see a partial file
+    with utils.atomic_path(parquet_path) as tmp:
+        data.to_parquet(tmp, index=False)
+
+
+def load(columns=None, csv_path=CSV_PATH, parquet_path=PARQUET_PATH):
+    """
+    Load tract data, reading only the requested columns
+    :param columns: columns to load, all columns when None
+    :param csv_path: source CSV
+    :param parquet_path: Parquet copy, (re)built when missing or older than the CSV
+    :return: DataFrame
+    """
+
+    if columns is not None:
+        columns = list(dict.fromkeys(columns))  # unique, in order
+
+    if not _has_pyarrow():
+        dtypes = schema()
+        if columns is not None:
+            dtypes = {column: dtype for column, dtype in dtypes.items() if column in columns}
+        with instrumentation.span("eji_data.load", format="csv"):
+            return pd.read_csv(csv_path, usecols=columns, dtype=dtypes)
+
+    if not os.path.exists(parquet_path) or os.path.getmtime(parquet_path) < os.path.getmtime(csv_path):
+        convert(csv_path, parquet_path)
+
+    with instrumentation.span("eji_data.load", format="parquet"):
+        return pd.read_parquet(parquet_path, columns=columns)
+
+
+def load_tracts(columns=None, csv_path=CSV_PATH, parquet_path=PARQUET_PATH):
+    """
+    Load tract data with the derived "County, State" column computed once at load time
+    :param columns: columns to load besides the ID columns, all columns when None
+    :param csv_path: source CSV
+    :param parquet_path: Parquet copy
+    :return: DataFrame
+    """
+
+    if columns is not None:
+        columns = ID_COLUMNS + [column for column in columns if column not in ID_COLUMNS]
+    data = load(columns=columns, csv_path=csv_path, parquet_path=parquet_path)
+    for column in ID_COLUMNS:
+        data[column] = data[column].astype("category")
+
+    # "County, State" is encoded from the pairs of county and state codes, one string per county
+    with instrumentation.span("eji_data.county_state", tracts=len(data)):
+        county, state = data["COUNTY"].cat, data["StateDesc"].cat
+        pairs = county.codes.to_numpy(dtype=np.int64) * len(state.categories) + state.codes.to_numpy(dtype=np.int64)
+        codes, uniques = pd.factorize(pairs, sort=False)
+        names = (county.categories[uniques // len(state.categories)].astype(str) + ", " +
+                 state.categories[uniques % len(state.categories)].astype(str))
+        data[COUNTY_STATE] = pd.Categorical.from_codes(codes, categories=names)
+
+    return data
+
+
+def category_mask(values, selected):
+    """
+    Rows whose category is one of the selected values, compared on the integer codes
+    :param values: categorical Series
+    :param selected: selected category values
+    :return: boolean numpy array
+    """
+
+    codes = values.cat.categories.get_indexer(list(selected))
+
+    return np.isin(values.cat.codes.to_numpy(), codes[codes >= 0])
+
+
+class CountyIndex(object):
+
+    def __init__(self, data, columns):
+        """
+        Index of the tracts by county, built once at load time: categorical county codes plus group
+        offsets into a tract array sorted by county, so a county's tracts are one contiguous slice
+        and per-county sums and means are a single reduction over the whole array
+        :param data: tract data as returned by load_tracts
+        :param columns: numeric columns kept in the sorted tract array
+        :return: self
+        """
+
+        with instrumentation.span("eji_data.county_index", tracts=len(data), columns=len(columns)):
+            county_state = data[COUNTY_STATE].astype("category").cat.remove_unused_categories()
+            codes = county_state.cat.codes.to_numpy()
+            names = county_state.cat.categories
+            self.names = pd.Index(names, name=COUNTY_STATE)  # in order of first appearance in load_tracts
+            self.columns = list(columns)
+            self.codes = codes
+
+            # tract rows grouped by county, county c spans offsets[c]:offsets[c+1]
+            self.order = np.argsort(codes, kind="stable")
+            self.counts = np.bincount(codes, minlength=len(names))
+            self.offsets = np.concatenate([[0], np.cumsum(self.counts)])
+            self.values = np.ascontiguousarray(data[self.columns].to_numpy(dtype=float)[self.order])
+
+            # per-county aggregates, one row per code
+            self.sums = np.add.reduceat(self.values, self.offsets[:-1], axis=0)
+            self.means = self.sums / self.counts[:, np.newaxis]
+
+            # first tract of each county, for the ID columns
+            self.first = self.order[self.offsets[:-1]]
+
+    def code(self, name):
+        """
+        Integer code of a county
+        :param name: "County, State"
+        :return: int
+        """
+
+        return self.names.get_loc(name)
+
+    def column(self, column):
+        """
+        Position of a column in the tract array
+        :param column: column name
+        :return: int
+        """
+
+        return self.columns.index(column)
+
+    def tracts(self, name):
+        """
+        Tract values of one county, a view into the sorted tract array
+        :param name: "County, State"
+        :return: tracts x columns numpy array
+        """
+
+        code = self.code(name)
+
+        return self.values[self.offsets[code]:self.offsets[code + 1]]
+
+
+def county_table(data=None, index=None):
+    """
+    County-level aggregate of the tract data: population sums, tract counts and the mean of every
+    measure in measure_groups, indexed by "County, State" in order of first appearance in the tract file
+    :param data: tract data as returned by load_tracts, with the population and measure columns
+    :param index: CountyIndex of data over the population and measure columns, built when None
+    :return: DataFrame
+    """
+
+    if data is None:
+        data = load_tracts(columns=[POPULATION_COLUMN] + measure_columns())
+    if index is None:
+        index = CountyIndex(data, [POPULATION_COLUMN] + measure_columns())
+
+    with instrumentation.span("eji_data.county_table", counties=len(index.names)):
+        table = pd.DataFrame(index.means, index=index.names, columns=index.columns)
+        table[POPULATION_COLUMN] = index.sums[:, index.column(POPULATION_COLUMN)].astype(np.int64)
+        table.insert(1, TRACT_COUNT, index.counts)
+        for column in reversed(ID_COLUMNS):
+            table.insert(0, column, data[column].iloc[index.first].array)
+
+    return table
+
+
+def tract_table(columns=None, data=None):
+    """
+    Tract-level table for analyses that keep every tract as its own unit, indexed by the 11-digit tract
+    GEOID (zero-padded, the CSV stores it as a number), with the ID columns and "County, State" first
+    :param columns: measure columns, every measure in measure_groups when None
+    :param data: tract data as returned by load_tracts, with the GEOID, population and measure columns
+    :return: DataFrame
+    """
+
+    if columns is None:
+        columns = measure_columns()
+    if data is None:
+        data = load_tracts(columns=[TRACT_ID, POPULATION_COLUMN] + list(columns))
+
+    table = data[ID_COLUMNS + [COUNTY_STATE, POPULATION_COLUMN] + list(columns)]
+    table.index = pd.Index(data[TRACT_ID].astype(str).str.zfill(11), name=TRACT_ID)
+
+    return table
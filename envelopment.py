@@ -8,13 +8,518 @@ http://deazone.com/en/resources/tutorial
 
 """
 
+import contextlib
+import hashlib
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+
 import numpy as np
-from scipy.optimize import fmin_slsqp
+from scipy import sparse
+from scipy.optimize import fmin_slsqp, linprog
+
+import instrumentation
+import utils
+
+# lambdas at or below this are solver noise, not peers
+LAMBDA_TOL = 1e-9
+
+# thetas within this of 1 count as efficient
+EFFICIENCY_TOL = 1e-6
+
+# units solved between two checkpoints of a checkpointed fit
+CHECKPOINT_UNITS = 1000
+
+
+class FitCancelled(RuntimeError):
+    """
+    Raised when a fit or update is cancelled through its cancel token
+    """
+
+
+class EnvelopmentModel(object):
+
+    measures = ("radial", "sbm")
+    orientations = ("input", "output")
+    returns_to_scale = ("constant", "variable")
+
+    def __init__(self, inputs, outputs, reference=None, exclude_self=False, measure="radial", orientation="input",
+                 returns="constant", scales=None):
+        """
+        Assemble the constraint blocks of the envelopment model once per dataset
+        LP rows are [inputs (m), outputs (r)], LP columns are [theta, lambda_1 .. lambda_k].
+        Only the theta column and the right-hand side depend on the unit being evaluated,
+        so each unit's model is a column swap plus a right-hand side read off the unit's data.
+        Variable returns to scale add one convexity row, output orientation moves the score column
+        to the output rows; the max-slack and SBM models extend the same lambda block with slack columns.
+        Every measure is divided by its column maximum first: normalized measures can be as small as
+        1e-6, below the solver's absolute feasibility tolerance, while thetas and lambdas do not change
+        under column scaling. Weights and slacks are scaled back to the original units.
+        :param inputs: inputs, n x m numpy array
+        :param outputs: outputs, n x r numpy array
+        :param reference: indices of the k units spanning the frontier, all units by default
+        :param exclude_self: keep each unit out of its own reference set (Andersen-Petersen super-efficiency)
+        :param measure: "radial" (CCR/BCC) or "sbm" (Tone's non-oriented slack-based measure)
+        :param orientation: "input" or "output", for the radial model
+        :param returns: "constant" (CCR) or "variable" (BCC) returns to scale
+        :param scales: (input scale, output scale) when inputs and outputs are already divided by them,
+            they are then used as they are, without a copy (see _shared_pool)
+        :return: self
+        """
+
+        if scales is None:
+            self.input_scale = _column_scale(inputs)
+            self.output_scale = _column_scale(outputs)
+            self.inputs = np.ascontiguousarray(inputs / self.input_scale, dtype=float)
+            self.outputs = np.ascontiguousarray(outputs / self.output_scale, dtype=float)
+        else:
+            self.input_scale, self.output_scale = scales
+            self.inputs, self.outputs = inputs, outputs
+        self.n, self.m = self.inputs.shape
+        self.r = self.outputs.shape[1]
+        self.reference = np.arange(self.n) if reference is None else np.asarray(reference, dtype=int)
+        self.k = len(self.reference)
+        self.measure = measure
+        self.orientation = orientation
+        self.returns = returns
+
+        # LP objective: min theta, or max phi for the output orientation
+        self.c = np.zeros(self.k + 1, dtype=float)
+        self.c[0] = 1.0 if orientation == "input" else -1.0
+
+        # LP constraint matrix, lambda block filled once: [X_ref^T; -Y_ref^T]
+        self.A_ub = np.zeros((self.m + self.r, self.k + 1), dtype=float)
+        self.A_ub[:self.m, 1:] = self.inputs[self.reference].T
+        self.A_ub[self.m:, 1:] = -self.outputs[self.reference].T
+
+        # right-hand side, rewritten per unit: [0; -y_unit], or [x_unit; 0] for the output orientation
+        self.b_ub = np.zeros(self.m + self.r, dtype=float)
+
+        # convexity row sum_j lambda_j = 1 under variable returns to scale
+        self.A_eq, self.b_eq = None, None
+        if returns == "variable":
+            self.A_eq = np.zeros((1, self.k + 1), dtype=float)
+            self.A_eq[0, 1:] = 1.0
+            self.b_eq = np.ones(1)
+
+        # variable bounds, the evaluated unit's lambda is pinned to 0 when it may not reference itself
+        self.exclude_self = exclude_self
+        self.bounds = np.zeros((self.k + 1, 2), dtype=float)
+        self.bounds[:, 1] = np.inf
+        self.position = np.full(self.n, -1, dtype=int)
+        self.position[self.reference] = np.arange(self.k)
+
+        # slack model [score, lambdas, input slacks, output slacks], built on first use
+        self.A_slack = None
+
+        # ratio-model constraints, built on first use by the slsqp backend
+        self.G = None
+
+    def lp(self, unit):
+        """
+        LP arrays for one unit; the constraint matrix is shared and updated in place
+        :param unit: which production unit to compute
+        :return: c, A_ub, b_ub
+        """
+
+        if self.orientation == "input":
+            self.A_ub[:self.m, 0] = -self.inputs[unit]
+            self.b_ub[self.m:] = -self.outputs[unit]
+        else:
+            self.A_ub[self.m:, 0] = self.outputs[unit]
+            self.b_ub[:self.m] = self.inputs[unit]
+
+        return self.c, self.A_ub, self.b_ub
+
+    def scale_reference(self, scale):
+        """
+        Evaluate the units against reference units with scaled inputs (bootstrap pseudo-frontiers):
+        only the input block of the lambda columns is rewritten, the evaluated units keep their own data
+        :param scale: input factor of every unit, length n
+        :return: nothing
+        """
+
+        self.A_ub[:self.m, 1:] = (self.inputs[self.reference] * scale[self.reference, np.newaxis]).T
+
+    def solve(self, unit):
+        """
+        Envelopment model for one unit, solved as an LP; CCR input orientation:
+        min theta
+        s.t. sum_j lambda_j * x_ij <= theta * x_i,unit   (each input i)
+             sum_j lambda_j * y_rj >= y_r,unit           (each output r)
+             theta, lambda_j >= 0
+        BCC adds sum_j lambda_j = 1, the output orientation maximizes phi with phi * y_r,unit on the output
+        rows and reports theta = 1 / phi. The input and output weights are the duals of the input and
+        output rows, scaled so that the unit's weighted inputs are 1. The sbm model is solved by sbm.
+        :param unit: which production unit to compute
+        :return: theta, lambdas over the reference units, input weights, output weights
+        """
+
+        if self.measure == "sbm":
+            return self.sbm(unit)
+
+        c, A_ub, b_ub = self.lp(unit)
+        bounds = (0, None)
+        if self.exclude_self and self.position[unit] >= 0:
+            bounds = self.bounds.copy()
+            bounds[1 + self.position[unit], 1] = 0.0
+        res = linprog(c, A_ub=A_ub, b_ub=b_ub, A_eq=self.A_eq, b_eq=self.b_eq, bounds=bounds, method="highs")
+        if res.status != 0:
+            raise RuntimeError("DEA model for unit %d could not be solved: %s" % (unit, res.message))
+        instrumentation.count("dea.lp_solves")
+        instrumentation.count("dea.solver_iterations", res.nit)
+
+        duals = -res.ineqlin.marginals
+        input_w, output_w = duals[:self.m] / self.input_scale, duals[self.m:] / self.output_scale
+        if self.orientation == "output":
+            # duals of max phi are normalized to u.y_unit = 1, v.x_unit = phi
+            phi = res.x[0]
+            return 1.0 / phi, res.x[1:], input_w / phi, output_w / phi
+        return res.x[0], res.x[1:], input_w, output_w
+
+    def __slack_structure(self):
+        """
+        Equality constraints over [score, lambdas, input slacks, output slacks], built once:
+        [X_ref^T  I  0; Y_ref^T  0  -I] plus the convexity row under variable returns to scale
+        """
+
+        if self.A_slack is None:
+            k, m, r = self.k, self.m, self.r
+            A = np.zeros((m + r + (self.returns == "variable"), 1 + k + m + r), dtype=float)
+            A[:m, 1:1 + k] = self.inputs[self.reference].T
+            A[m:m + r, 1:1 + k] = self.outputs[self.reference].T
+            A[:m, 1 + k:1 + k + m] = np.identity(m)
+            A[m:m + r, 1 + k + m:] = -np.identity(r)
+            if self.returns == "variable":
+                A[m + r, 1:1 + k] = 1.0
+            self.A_slack = A
+
+        return self.A_slack
+
+    def slacks(self, unit, theta, lambdas):
+        """
+        Second-stage max-slack solve of the radial model: with the score fixed at its optimum,
+        max sum of input and output slacks
+        s.t. sum_j lambda_j * x_ij + s_i = theta * x_i,unit,  sum_j lambda_j * y_rj - s_r = y_r,unit
+        (inputs fixed at x_unit and outputs at y_unit / theta for the output orientation).
+        The sbm solution already carries its slacks, they are read off its lambdas.
+        :param unit: which production unit to compute
+        :param theta: the unit's score from solve
+        :param lambdas: the unit's lambdas from solve
+        :return: input slacks, output slacks
+        """
+
+        if self.measure == "sbm":
+            input_slacks = self.inputs[unit] - np.dot(lambdas, self.inputs[self.reference])
+            output_slacks = np.dot(lambdas, self.outputs[self.reference]) - self.outputs[unit]
+            return (np.maximum(input_slacks, 0.0) * self.input_scale,
+                    np.maximum(output_slacks, 0.0) * self.output_scale)
+
+        A = self.__slack_structure()
+        k, m, r = self.k, self.m, self.r
+        b = np.zeros(A.shape[0], dtype=float)
+        A[:, 0] = 0.0
+        if self.orientation == "input":
+            A[:m, 0] = -self.inputs[unit]
+            b[m:m + r] = self.outputs[unit]
+            score = theta
+        else:
+            A[m:m + r, 0] = -self.outputs[unit]
+            b[:m] = self.inputs[unit]
+            score = 1.0 / theta
+        if self.returns == "variable":
+            b[m + r] = 1.0
+
+        c = np.zeros(1 + k + m + r, dtype=float)
+        c[1 + k:] = -1.0
+        bounds = np.zeros((1 + k + m + r, 2), dtype=float)
+        bounds[:, 1] = np.inf
+        bounds[0] = score
+        if self.exclude_self and self.position[unit] >= 0:
+            bounds[1 + self.position[unit], 1] = 0.0
+        res = linprog(c, A_eq=A, b_eq=b, bounds=bounds, method="highs")
+        if res.status != 0:
+            raise RuntimeError("Slack model for unit %d could not be solved: %s" % (unit, res.message))
+        instrumentation.count("dea.lp_solves")
+        instrumentation.count("dea.solver_iterations", res.nit)
+
+        return (np.maximum(res.x[1 + k:1 + k + m], 0.0) * self.input_scale,
+                np.maximum(res.x[1 + k + m:], 0.0) * self.output_scale)
+
+    def sbm(self, unit):
+        """
+        Tone's slack-based measure for one unit, linearized (Charnes-Cooper) on the slack structure:
+        min t - 1/m sum_i S_i / x_i,unit
+        s.t. t + 1/r sum_r S_r / y_r,unit = 1
+             sum_j L_j * x_ij + S_i = t * x_i,unit,  sum_j L_j * y_rj - S_r = t * y_r,unit
+             (sum_j L_j = t under variable returns to scale), t, L, S >= 0
+        lambdas are L / t and slacks S / t. The weights are the duals of the input and output rows,
+        the SBM prices, not ratio-model weights.
+        :param unit: which production unit to compute
+        :return: rho, lambdas over the reference units, input weights, output weights
+        """
+
+        A = self.__slack_structure()
+        k, m, r = self.k, self.m, self.r
+        A = np.vstack([A, np.zeros((1, A.shape[1]))])
+        A[:m, 0] = -self.inputs[unit]
+        A[m:m + r, 0] = -self.outputs[unit]
+        if self.returns == "variable":
+            A[m + r, 0] = -1.0
+        A[-1, 0] = 1.0
+        A[-1, 1 + k + m:] = 1.0 / (r * self.outputs[unit])
+        b = np.zeros(A.shape[0], dtype=float)
+        b[-1] = 1.0
+
+        c = np.zeros(1 + k + m + r, dtype=float)
+        c[0] = 1.0
+        c[1 + k:1 + k + m] = -1.0 / (m * self.inputs[unit])
+        bounds = np.zeros((1 + k + m + r, 2), dtype=float)
+        bounds[:, 1] = np.inf
+        if self.exclude_self and self.position[unit] >= 0:
+            bounds[1 + self.position[unit], 1] = 0.0
+        res = linprog(c, A_eq=A, b_eq=b, bounds=bounds, method="highs")
+        if res.status != 0:
+            raise RuntimeError("SBM model for unit %d could not be solved: %s" % (unit, res.message))
+        instrumentation.count("dea.lp_solves")
+        instrumentation.count("dea.solver_iterations", res.nit)
+
+        t = res.x[0]
+        duals = res.eqlin.marginals
+        return (res.fun, res.x[1:1 + k] / t, np.abs(duals[:m]) / self.input_scale,
+                np.abs(duals[m:m + r]) / self.output_scale)
+
+    def constraints(self, t, lambdas, unit):
+        """
+        Inequality constraints of the ratio model for one unit, as one sparse product
+        :param t: theta target value
+        :param lambdas: unit weights, length n (the ratio model always uses every unit as reference)
+        :param unit: which production unit to compute
+        :return: array of constraints, [t*x_unit - X^T lambdas; Y^T lambdas - y_unit; lambdas]
+        """
+
+        if self.G is None:
+            # [-X^T; Y^T; I] in the lambdas on the unscaled data, the nonnegativity block is a sparse identity
+            self.G = sparse.vstack([sparse.csr_matrix(-(self.inputs * self.input_scale).T),
+                                    sparse.csr_matrix((self.outputs * self.output_scale).T),
+                                    sparse.identity(self.n, format="csr")], format="csr")
+
+        constr = self.G.dot(lambdas)
+        constr[:self.m] += t*self.inputs[unit]*self.input_scale
+        constr[self.m:(self.m+self.r)] -= self.outputs[unit]*self.output_scale
+
+        return constr
+
+
+class MultiplierModel(EnvelopmentModel):
+
+    def __init__(self, inputs, outputs, reference=None, exclude_self=False, measure="radial", orientation="input",
+                 returns="constant", restrictions=None, scales=None):
+        """
+        Multiplier (weight) form of the radial model, the LP dual of the envelopment form
+        LP columns are [input weights (m), output weights (r)], plus a free scale column under variable
+        returns to scale; LP rows are one ratio constraint per reference unit, then the weight restrictions.
+        The rows never depend on the unit being evaluated, only the objective and the normalization row do.
+        The envelopment arrays are kept for the max-slack second stage.
+        :param inputs: inputs, n x m numpy array
+        :param outputs: outputs, n x r numpy array
+        :param reference: indices of the k units spanning the frontier, all units by default
+        :param exclude_self: keep each unit out of its own reference set, see EnvelopmentModel
+        :param measure: only "radial", the multiplier form has no slack-based measure
+        :param orientation: "input" or "output"
+        :param returns: "constant" (CCR) or "variable" (BCC) returns to scale
+        :param restrictions: assurance regions, (i, j, lower, upper) tuples bounding the weight ratio
+            w_i / w_j, indices into [input weights, output weights], None for an open bound
+        :param scales: column scales of already scaled inputs and outputs, see EnvelopmentModel
+        :return: self
+        """
+
+        if measure != "radial":
+            raise ValueError("The multiplier form only supports the radial measure, got %r" % measure)
+        EnvelopmentModel.__init__(self, inputs, outputs, reference, exclude_self, measure, orientation, returns,
+                                  scales)
+        k, m, r = self.k, self.m, self.r
+        # w_i / w_j bounds on the original weights, w = scaled weight / column scale
+        restricted = restriction_rows(restrictions, m, r) / np.concatenate([self.input_scale, self.output_scale])
+        w = m + r + (returns == "variable")
+
+        # ratio rows u.y_j - v.x_j (- w0) <= 0 of the reference units, then the homogeneous restriction rows
+        self.M_ub = np.zeros((k + len(restricted), w), dtype=float)
+        self.M_ub[:k, :m] = -self.inputs[self.reference]
+        self.M_ub[:k, m:m + r] = self.outputs[self.reference]
+        self.M_ub[k:, :m + r] = restricted
+        if returns == "variable":
+            self.M_ub[:k, m + r] = -1.0
+        self.M_rhs = np.zeros(len(self.M_ub), dtype=float)
+
+        # objective and normalization row, rewritten per unit
+        self.M_c = np.zeros(w, dtype=float)
+        self.M_eq = np.zeros((1, w), dtype=float)
+        if returns == "variable":
+            self.M_c[m + r] = 1.0
+
+        self.M_bounds = np.zeros((w, 2), dtype=float)
+        self.M_bounds[:, 1] = np.inf
+        if returns == "variable":
+            self.M_bounds[m + r, 0] = -np.inf
+
+    def scale_reference(self, scale):
+        """
+        Evaluate the units against reference units with scaled inputs, see EnvelopmentModel.scale_reference
+        :param scale: input factor of every unit, length n
+        :return: nothing
+        """
+
+        EnvelopmentModel.scale_reference(self, scale)
+        self.M_ub[:self.k, :self.m] = -self.inputs[self.reference] * scale[self.reference, np.newaxis]
+
+    def solve(self, unit):
+        """
+        Multiplier model for one unit, solved as an LP; CCR input orientation:
+        max u.y_unit
+        s.t. v.x_unit = 1
+             u.y_j - v.x_j <= 0   (each reference unit j)
+             u, v >= 0
+        BCC subtracts a free u0 from the objective and the ratio rows, the output orientation
+        minimizes v.x_unit (+ v0) with u.y_unit = 1 and reports theta = 1 / phi.
+        The lambdas are the duals of the ratio rows.
+        :param unit: which production unit to compute
+        :return: theta, lambdas over the reference units, input weights, output weights
+        """
+
+        m, r = self.m, self.r
+        self.M_c[:m + r] = 0.0
+        self.M_eq[0, :m + r] = 0.0
+        if self.orientation == "input":
+            self.M_c[m:m + r] = -self.outputs[unit]
+            self.M_eq[0, :m] = self.inputs[unit]
+        else:
+            self.M_c[:m] = self.inputs[unit]
+            self.M_eq[0, m:m + r] = self.outputs[unit]
+
+        rows = slice(None)
+        if self.exclude_self and self.position[unit] >= 0:
+            rows = np.arange(len(self.M_ub)) != self.position[unit]
+        res = linprog(self.M_c, A_ub=self.M_ub[rows], b_ub=self.M_rhs[rows], A_eq=self.M_eq, b_eq=[1.0],
+                      bounds=self.M_bounds, method="highs")
+        if res.status != 0:
+            raise RuntimeError("DEA model for unit %d could not be solved: %s" % (unit, res.message))
+        instrumentation.count("dea.lp_solves")
+        instrumentation.count("dea.solver_iterations", res.nit)
+
+        lambdas = np.zeros(self.k, dtype=float)
+        duals = -res.ineqlin.marginals
+        if self.exclude_self and self.position[unit] >= 0:
+            lambdas[rows[:self.k]] = duals[:self.k - 1]
+        else:
+            lambdas[:] = duals[:self.k]
+        if self.orientation == "output":
+            # weights normalized to v.x_unit = 1, like the input orientation
+            phi = res.fun
+            return 1.0 / phi, lambdas, res.x[:m] / self.input_scale / phi, res.x[m:m + r] / self.output_scale / phi
+        return -res.fun, lambdas, res.x[:m] / self.input_scale, res.x[m:m + r] / self.output_scale
+
+
+def _column_scale(values):
+    """
+    Column maxima to divide a measure matrix by, 1 for columns without a positive value
+    :param values: n x d numpy array
+    :return: array of length d
+    """
+
+    values = np.asarray(values, dtype=float)
+    if values.shape[0] == 0:
+        return np.ones(values.shape[1])
+    scale = values.max(axis=0)
+
+    return np.where(scale > 0, scale, 1.0)
+
+
+def restriction_rows(restrictions, m, r):
+    """
+    Assurance regions as homogeneous rows over the weights: lower <= w_i / w_j <= upper becomes
+    w_i - upper * w_j <= 0 and lower * w_j - w_i <= 0
+    :param restrictions: (i, j, lower, upper) tuples, indices into [input weights, output weights]
+    :param m: number of inputs
+    :param r: number of outputs
+    :return: p x (m + r) numpy array
+    """
+
+    rows = []
+    for i, j, lower, upper in restrictions or ():
+        if not (0 <= i < m + r and 0 <= j < m + r) or i == j:
+            raise ValueError("Weight restriction (%r, %r) needs two different weights below %d" % (i, j, m + r))
+        if lower is None and upper is None:
+            raise ValueError("Weight restriction (%d, %d) has neither a lower nor an upper bound" % (i, j))
+        if (lower is not None and lower < 0) or (lower is not None and upper is not None and lower > upper):
+            raise ValueError("Weight restriction (%d, %d) has invalid bounds %r, %r" % (i, j, lower, upper))
+        if upper is not None:
+            row = np.zeros(m + r, dtype=float)
+            row[i], row[j] = 1.0, -upper
+            rows.append(row)
+        if lower is not None:
+            row = np.zeros(m + r, dtype=float)
+            row[i], row[j] = -1.0, lower
+            rows.append(row)
+
+    return np.asarray(rows, dtype=float).reshape(len(rows), m + r)
+
+
+def build_model(inputs, outputs, reference=None, formulation="envelopment", restrictions=None, **options):
+    """
+    LP model of a dataset in one formulation. "auto" takes the multiplier form when weights are restricted,
+    otherwise the form with the smaller simplex basis: the envelopment form has one row per measure,
+    the multiplier form one row per reference unit.
+    :param inputs: inputs, n x m numpy array
+    :param outputs: outputs, n x r numpy array
+    :param reference: indices of the reference units, all units by default
+    :param formulation: "envelopment", "multiplier" or "auto"
+    :param restrictions: weight restrictions, see MultiplierModel
+    :param options: further EnvelopmentModel keyword arguments
+    :return: EnvelopmentModel or MultiplierModel
+    """
+
+    if formulation == "auto":
+        formulation = choose_formulation(inputs.shape[0] if reference is None else len(reference),
+                                         inputs.shape[1], outputs.shape[1], restrictions, **options)
+    if formulation == "multiplier":
+        return MultiplierModel(inputs, outputs, reference, restrictions=restrictions, **options)
+    if formulation != "envelopment":
+        raise ValueError("Unknown formulation %r, expected one of auto, envelopment, multiplier" % formulation)
+    if restrictions:
+        raise ValueError("Weight restrictions need the multiplier formulation")
+
+    return EnvelopmentModel(inputs, outputs, reference, **options)
+
+
+def choose_formulation(k, m, r, restrictions=None, measure="radial", **options):
+    """
+    Cheaper formulation for a problem shape, see build_model
+    :param k: number of reference units
+    :param m: number of inputs
+    :param r: number of outputs
+    :param restrictions: weight restrictions
+    :param measure: EnvelopmentModel measure
+    :param options: other EnvelopmentModel options, unused
+    :return: "envelopment" or "multiplier"
+    """
+
+    if measure != "radial":
+        return "envelopment"
+    if restrictions:
+        return "multiplier"
+
+    return "multiplier" if k < m + r else "envelopment"
 
 
 class DEA(object):
 
-    def __init__(self, inputs, outputs):
+    solvers = ("linprog", "slsqp")
+    formulations = ("auto", "envelopment", "multiplier")
+
+    def __init__(self, inputs, outputs, solver="linprog", measure="radial", orientation="input",
+                 returns="constant", formulation="auto", restrictions=None):
         """
         Initialize the DEA object with input data
         n = number of entities (observations)
@@ -22,9 +527,30 @@ class DEA(object):
         r = number of outputs
         :param inputs: inputs, n x m numpy array
         :param outputs: outputs, n x r numpy array
+        :param solver: "linprog" solves the envelopment model as an exact LP (HiGHS),
+                       "slsqp" uses the original nonlinear ratio formulation (input-oriented CCR only)
+        :param measure: "radial" (CCR/BCC) or "sbm" (slack-based measure), see EnvelopmentModel
+        :param orientation: "input" or "output", for the radial measure
+        :param returns: "constant" (CCR) or "variable" (BCC) returns to scale
+        :param formulation: LP form of the linprog solver, "envelopment", "multiplier" or "auto" to pick
+                            the cheaper one from the problem shape (see build_model); the thetas agree
+        :param restrictions: assurance regions on the weights, (i, j, lower, upper) tuples bounding
+                             w_i / w_j with i, j indexing [inputs, outputs]; solved in the multiplier form
         :return: self
         """
 
+        if solver not in self.solvers:
+            raise ValueError("Unknown solver %r, expected one of %s" % (solver, ", ".join(self.solvers)))
+        for option, value, values in (("measure", measure, EnvelopmentModel.measures),
+                                      ("orientation", orientation, EnvelopmentModel.orientations),
+                                      ("returns", returns, EnvelopmentModel.returns_to_scale),
+                                      ("formulation", formulation, self.formulations)):
+            if value not in values:
+                raise ValueError("Unknown %s %r, expected one of %s" % (option, value, ", ".join(values)))
+        if solver == "slsqp" and ((measure, orientation, returns) != ("radial", "input", "constant") or restrictions):
+            raise ValueError("The slsqp solver only supports the unrestricted radial, input-oriented, "
+                             "constant returns model")
+
         # supplied data
         self.inputs = inputs
         self.outputs = outputs
@@ -39,15 +565,39 @@ class DEA(object):
         self.input_ = range(self.m)
         self.output_ = range(self.r)
 
-        # result arrays
-        self.output_w = np.zeros((self.r, 1), dtype=float)  # output weights
-        self.input_w = np.zeros((self.m, 1), dtype=float)  # input weights
-        self.lambdas = np.zeros((self.n, 1), dtype=float)  # unit efficiencies
-        self.efficiency = np.zeros_like(self.lambdas)  # thetas
+        # result arrays, one row per unit
+        self.output_w = np.zeros((self.n, self.r), dtype=float)  # output weights
+        self.input_w = np.zeros((self.n, self.m), dtype=float)  # input weights
+        self.lambdas = sparse.csr_matrix((self.n, self.n), dtype=float)  # peer weights, row = unit, column = peer
+        self.efficiency = np.zeros((self.n, 1), dtype=float)  # thetas
+        self._referenced = None  # column-major copy of the lambdas for reverse peer lookups
+        self.frontier = np.zeros(0, dtype=int)  # efficient units
+        self.intervals = None  # bootstrap bias corrections and confidence intervals, see bootstrap
+        self.input_slacks = None  # max-slack second stage, see fit
+        self.output_slacks = None
 
         # names
         self.names = []
 
+        # solver backend
+        self.solver = solver
+        self.options = {"measure": measure, "orientation": orientation, "returns": returns,
+                        "formulation": formulation, "restrictions": restrictions}
+        self.model = build_model(inputs, outputs, **self.options)
+
+    def __require(self, feature, **options):
+        """
+        Check that the model family supports a feature
+        :param feature: feature name, for the error message
+        :param options: required EnvelopmentModel options
+        :return: nothing
+        """
+
+        for option, value in options.items():
+            if self.options[option] != value:
+                raise ValueError("%s is only supported with %s=%r, the model uses %r"
+                                 % (feature, option, value, self.options[option]))
+
     def __efficiency(self, unit):
         """
         Efficiency function with already computed weights
@@ -55,11 +605,11 @@ class DEA(object):
         :return: efficiency
         """
 
-        # compute efficiency
-        denominator = np.dot(self.inputs, self.input_w)
-        numerator = np.dot(self.outputs, self.output_w)
+        # compute efficiency with the unit's own weights
+        denominator = np.dot(self.inputs[unit], self.input_w[unit])
+        numerator = np.dot(self.outputs[unit], self.output_w[unit])
 
-        return (numerator/denominator)[unit]
+        return numerator/denominator
 
     def __target(self, x, unit):
         """
@@ -82,46 +632,456 @@ class DEA(object):
         :return: array of constraints
         """
 
-        in_w, out_w, lambdas = x[:self.m], x[self.m:(self.m+self.r)], x[(self.m+self.r):]  # unroll the weights
-        constr = []  # init the constraint array
-
-        # for each input, lambdas with inputs
-        for input in self.input_:
-            t = self.__target(x, unit)
-            lhs = np.dot(self.inputs[:, input], lambdas)
-            cons = t*self.inputs[unit, input] - lhs
-            constr.append(cons)
+        lambdas = x[(self.m+self.r):]  # unroll the weights
 
-        # for each output, lambdas with outputs
-        for output in self.output_:
-            lhs = np.dot(self.outputs[:, output], lambdas)
-            cons = lhs - self.outputs[unit, output]
-            constr.append(cons)
+        return self.model.constraints(self.__target(x, unit), lambdas, unit)
 
-        # for each unit
-        for u in self.unit_:
-            constr.append(lambdas[u])
-
-        return np.array(constr)
-
-    def __optimize(self):
+    def __optimize(self, n_jobs=1, screen=False, progress=None, cancel=None, slacks=False, partitions=None,
+                   checkpoint=None):
         """
         Optimization of the DEA model
         Use: http://docs.scipy.org/doc/scipy-0.17.0/reference/generated/scipy.optimize.linprog.html
         A = coefficients in the constraints
         b = rhs of constraints
         c = coefficients of the target function
+        :param n_jobs: number of worker processes for the linprog backend, -1 for all cores
+        :param screen: score every unit against the frontier found by frontier_units only
+        :param progress: called as progress(unit, theta) as each unit is solved
+        :param cancel: token whose is_set() stops the solve with FitCancelled, e.g. a threading.Event
+        :param slacks: also solve the slacks, see EnvelopmentModel.slacks
+        :param partitions: screen the frontier partition by partition, see partition_frontier
+        :param checkpoint: directory keeping the screened frontier and the finished chunks of units
         :return:
         """
+        self.input_slacks, self.output_slacks = None, None
+        if self.solver == "linprog":
+            if slacks and self.options["restrictions"]:
+                raise ValueError("slacks are not defined under weight restrictions")
+            slacks = slacks or self.options["measure"] == "sbm"
+            if checkpoint is not None:
+                _open_checkpoint(checkpoint, {
+                    "n": self.n, "m": self.m, "r": self.r, "data": _data_digest(self.inputs, self.outputs),
+                    "options": self.options, "screen": bool(screen or partitions is not None),
+                    "partitions": None if partitions is None else _data_digest(*partitions),
+                    "slacks": slacks, "chunk_units": CHECKPOINT_UNITS})
+
+            model = self.model
+            if screen or partitions is not None:
+                # the constant returns frontier spans every constant returns model, not the BCC one
+                self.__require("screen", returns="constant")
+                path = None if checkpoint is None else os.path.join(checkpoint, "reference.npz")
+                if path is not None and os.path.exists(path):
+                    reference = _load_checkpoint(path)["reference"]
+                else:
+                    with instrumentation.span("dea.screen", n=self.n):
+                        if partitions is None:
+                            reference = frontier_units(self.inputs, self.outputs)
+                        else:
+                            reference = partition_frontier(self.inputs, self.outputs, partitions, n_jobs)
+                    if path is not None:
+                        _save_checkpoint(path, reference=reference)
+                instrumentation.count("dea.frontier_size", len(reference))
+                model = build_model(self.inputs, self.outputs, reference, **self.options)
+
+            def solve(units):
+                if n_jobs == 1:
+                    return [_solve_chunk(model, units, progress, cancel, slacks)]
+                return _solve_parallel(self.inputs, self.outputs, n_jobs, model.reference, units=units,
+                                       progress=progress, cancel=cancel, options=self.options, slacks=slacks)
+
+            if checkpoint is None:
+                results = solve(np.arange(self.n))
+            else:
+                # chunks finished by an earlier, killed fit are read back instead of solved again
+                results = []
+                for units in np.array_split(np.arange(self.n), max(1, -(-self.n // CHECKPOINT_UNITS))):
+                    path = os.path.join(checkpoint, "units_%d_%d.npz" % (units[0], units[-1] + 1))
+                    if os.path.exists(path):
+                        result = _load_results(path)
+                        instrumentation.count("dea.checkpointed_units", len(units))
+                        if progress is not None:
+                            for unit, theta in zip(result[0], result[1]):
+                                progress(unit, theta)
+                    else:
+                        result = _stack_results(solve(units))
+                        _save_results(path, result)
+                    results.append(result)
+
+            # merge in unit order, independent of which worker solved what
+            if slacks:
+                self.input_slacks = np.zeros((self.n, self.m), dtype=float)
+                self.output_slacks = np.zeros((self.n, self.r), dtype=float)
+            for units, thetas, lambdas, input_w, output_w, input_slacks, output_slacks in results:
+                self.efficiency[units, 0] = thetas
+                self.input_w[units] = input_w
+                self.output_w[units] = output_w
+                if slacks:
+                    self.input_slacks[units] = input_slacks
+                    self.output_slacks[units] = output_slacks
+            self.lambdas = sparse.vstack([result[2] for result in results], format="csr")
+            self._referenced = None
+            self.intervals = None
+            self.frontier = np.flatnonzero(self.efficiency[:, 0] >= 1 - EFFICIENCY_TOL)
+            return
+
+        if n_jobs != 1 or screen or slacks or partitions is not None or checkpoint is not None:
+            raise ValueError("n_jobs, screen, slacks, partitions and checkpoint are only supported by the "
+                             "linprog solver")
+
         d0 = self.m + self.r + self.n
+        lambdas = []
         # iterate over units
         for unit in self.unit_:
+            _check_cancel(cancel)
             # weights
             x0 = np.random.rand(d0) - 0.5
             x0 = fmin_slsqp(self.__target, x0, f_ieqcons=self.__constraints, args=(unit,))
             # unroll weights
-            self.input_w, self.output_w, self.lambdas = x0[:self.m], x0[self.m:(self.m+self.r)], x0[(self.m+self.r):]
+            self.input_w[unit], self.output_w[unit] = x0[:self.m], x0[self.m:(self.m+self.r)]
+            lambdas.append(x0[(self.m+self.r):])
             self.efficiency[unit] = self.__efficiency(unit)
+            if progress is not None:
+                progress(unit, self.efficiency[unit, 0])
+        self.lambdas = _sparse_rows(lambdas, self.n)
+        self._referenced = None
+        self.intervals = None
+        self.frontier = np.flatnonzero(self.efficiency[:, 0] >= 1 - EFFICIENCY_TOL)
+
+    def peers(self, unit):
+        """
+        Reference set of one unit, the units with a nonzero lambda in its solution
+        :param unit: which production unit
+        :return: array of peer unit indices
+        """
+
+        start, end = self.lambdas.indptr[unit], self.lambdas.indptr[unit + 1]
+
+        return self.lambdas.indices[start:end]
+
+    def referenced_by(self, peer):
+        """
+        Units that have the given unit in their reference set
+        :param peer: which production unit
+        :return: array of unit indices
+        """
+
+        if self._referenced is None:
+            self._referenced = self.lambdas.tocsc()
+        start, end = self._referenced.indptr[peer], self._referenced.indptr[peer + 1]
+
+        return self._referenced.indices[start:end]
+
+    def targets(self):
+        """
+        Frontier projections of every unit and the gaps to them, computed from the stored lambdas as one
+        sparse product over all units: a unit's targets are its peer combination, lambda.X and lambda.Y.
+        Under input orientation they are theta * x less the input slacks the solution left, so the input
+        gaps are how far each input has to fall for the unit to reach the frontier; for the output
+        orientation and SBM they are the matching output-side and non-oriented projections.
+        :return: dict with input_targets (n x m), output_targets (n x r), input_gaps (inputs - targets)
+            and output_gaps (targets - outputs), gaps floored at 0
+        """
+
+        input_targets = np.asarray(self.lambdas.dot(self.inputs))
+        output_targets = np.asarray(self.lambdas.dot(self.outputs))
+
+        return {"input_targets": input_targets,
+                "output_targets": output_targets,
+                "input_gaps": np.maximum(self.inputs - input_targets, 0.0),
+                "output_gaps": np.maximum(output_targets - self.outputs, 0.0)}
+
+    def super_efficiency(self, n_jobs=1):
+        """
+        Andersen-Petersen super-efficiency: each unit scored against all the other units, so efficient
+        units get scores above 1 that rank them. Inefficient units keep their theta, only the frontier
+        units are solved again.
+        :param n_jobs: number of worker processes, -1 for all cores
+        :return: array of scores, length n
+        """
+
+        if self.solver != "linprog":
+            raise ValueError("super_efficiency is only supported by the linprog solver")
+        # without constant returns the leave-self-out model can be infeasible
+        self.__require("super_efficiency", measure="radial", returns="constant")
+
+        scores = self.efficiency[:, 0].copy()
+        options = dict(self.options, exclude_self=True)
+        if n_jobs == 1:
+            results = [_solve_chunk(build_model(self.inputs, self.outputs, **options), self.frontier)]
+        else:
+            results = _solve_parallel(self.inputs, self.outputs, n_jobs, units=self.frontier, options=options)
+        for units, thetas, _, _, _, _, _ in results:
+            scores[units] = thetas
+
+        return scores
+
+    def sensitivity(self, variants, n_jobs=1, screen=False):
+        """
+        Thetas of every unit under other selections of the measures, e.g. leaving one input out.
+        Each variant is a column subset of this model's data solved with the same options; the variants
+        are spread over one process pool that shares a single copy of the data.
+        :param variants: list of (input columns, output columns) index lists, each keeping at least one
+            input and one output
+        :param n_jobs: number of worker processes, -1 for all cores
+        :param screen: screen each variant's frontier before scoring (constant returns only)
+        :return: n x len(variants) numpy array of thetas, one column per variant
+        """
+
+        if self.solver != "linprog":
+            raise ValueError("sensitivity is only supported by the linprog solver")
+        # restrictions index the full set of weights
+        self.__require("sensitivity", restrictions=None)
+        if screen:
+            self.__require("screen", returns="constant")
+
+        tasks = []
+        for input_columns, output_columns in variants:
+            input_columns, output_columns = list(input_columns), list(output_columns)
+            if len(input_columns) == 0 or len(output_columns) == 0:
+                raise ValueError("A sensitivity variant needs at least one input and one output")
+            assert(max(input_columns) < self.m and max(output_columns) < self.r)
+            tasks.append((input_columns, output_columns, self.options, screen))
+
+        with instrumentation.span("dea.sensitivity", n=self.n, variants=len(tasks), n_jobs=n_jobs):
+            if n_jobs == 1:
+                columns = [_variant_thetas(self.inputs, self.outputs, *task) for task in tasks]
+            else:
+                jobs = utils.worker_count(n_jobs, len(tasks))
+                with _shared_pool(self.inputs, self.outputs, jobs) as pool:
+                    columns = list(pool.map(_sensitivity_worker, tasks))
+
+        return np.column_stack(columns) if columns else np.zeros((self.n, 0))
+
+    def cross_efficiency(self, mean=False):
+        """
+        Cross-efficiency matrix: entry (i, j) is unit j's efficiency under unit i's weights, computed for all
+        pairs as one ratio of two matrix products, (U Y^T) / (V X^T). The weights are the ones the solver
+        returned; where a unit has alternative optimal weights, its row reflects that choice.
+        :param mean: return each unit's mean appraisal by the other units instead of the matrix
+        :return: n x n numpy array (raters in rows), or array of length n
+        """
+
+        self.__require("cross_efficiency", measure="radial", returns="constant")
+
+        matrix = np.dot(self.output_w, self.outputs.T) / np.dot(self.input_w, self.inputs.T)
+        if not mean:
+            return matrix
+
+        return (matrix.sum(axis=0) - np.diag(matrix)) / max(self.n - 1, 1)
+
+    def bootstrap(self, replications=1000, alpha=0.05, n_jobs=1, seed=None, chunk_size=10, cancel=None):
+        """
+        Simar-Wilson smoothed bootstrap of the fitted thetas (homogeneous, input-oriented). As in Simar &
+        Wilson (1998) the resampling runs on the Shephard distances 1 / theta >= 1: each replication draws
+        distances from a kernel estimate of the fitted ones reflected around 1, rescales every unit's inputs
+        onto a pseudo-frontier and scores the original units against it. The bias correction and the basic
+        intervals are formed on the distances, kept >= 1, and turned back into thetas, so they lie in (0, 1].
+        A unit with a fitted theta near 0, typically an outlier with a measure near 0, has a distance in the
+        thousands. Whenever that distance is drawn for a frontier unit, the frontier unit's pseudo-inputs grow
+        by as much and the units it supports score far above 1 in that replication. The quantile-based
+        intervals barely move, but std can exceed 1; screen such outliers out before bootstrapping.
+        Replications are streamed into running means and P-square quantile estimates, so memory does not
+        grow with the number of replications.
+        Simar & Wilson suggest applying the bias correction only where |bias| > std / sqrt(3).
+        :param replications: number of bootstrap replications, at least 5
+        :param alpha: the intervals cover 1 - alpha
+        :param n_jobs: number of worker processes, -1 for all cores
+        :param seed: random seed, results do not depend on n_jobs
+        :param chunk_size: replications per task
+        :param cancel: token checked between chunks, see fit
+        :return: dict with efficiency, bias, bias_corrected, std, lower and upper, arrays of length n,
+            also kept as self.intervals until the next fit or update
+        """
+
+        if self.solver != "linprog":
+            raise ValueError("bootstrap is only supported by the linprog solver")
+        self.__require("bootstrap", measure="radial", orientation="input")
+        if replications < 5:
+            raise ValueError("bootstrap needs at least 5 replications, got %d" % replications)
+
+        thetas = self.efficiency[:, 0].copy()
+        distances = 1.0 / thetas
+        bandwidth = _bootstrap_bandwidth(distances)
+        sizes = [len(chunk) for chunk in np.array_split(np.arange(replications), -(-replications // chunk_size))]
+        tasks = [(distances, bandwidth, seed_seq, size)
+                 for seed_seq, size in zip(np.random.SeedSequence(seed).spawn(len(sizes)), sizes)]
+
+        # streamed statistics: mean and quantiles of the bootstrap distances, spread of the bootstrap thetas
+        count, mean, theta_mean, m2 = 0, np.zeros(self.n), np.zeros(self.n), np.zeros(self.n)
+        lower, upper = P2Quantiles(alpha / 2, self.n), P2Quantiles(1 - alpha / 2, self.n)
+
+        def chunks():
+            if n_jobs == 1:
+                model = build_model(self.inputs, self.outputs, **self.options)
+                for task in tasks:
+                    _check_cancel(cancel)
+                    yield _bootstrap_chunk(model, *task)
+            else:
+                jobs = utils.worker_count(n_jobs, len(tasks))
+                with _shared_pool(self.inputs, self.outputs, jobs, options=self.options) as pool:
+                    futures = [pool.submit(_bootstrap_worker, task) for task in tasks]
+                    try:
+                        for future in futures:
+                            _check_cancel(cancel)
+                            yield future.result()
+                    finally:
+                        for future in futures:
+                            future.cancel()
+
+        with instrumentation.span("dea.bootstrap", n=self.n, replications=replications, n_jobs=n_jobs):
+            for chunk in chunks():
+                for row in chunk:
+                    count += 1
+                    mean += (1.0 / row - mean) / count
+                    delta = row - theta_mean
+                    theta_mean += delta / count
+                    m2 += delta * (row - theta_mean)
+                    lower.add(1.0 / row)
+                    upper.add(1.0 / row)
+
+        # the spread of the bootstrap distances around the fit stands in for the fit's spread around the
+        # truth; true distances are at least 1, so are the corrected ones and the interval bounds
+        corrected = np.maximum(2 * distances - mean, 1.0)
+        self.intervals = {"efficiency": thetas,
+                          "bias": thetas - 1.0 / corrected,
+                          "bias_corrected": 1.0 / corrected,
+                          "std": np.sqrt(m2 / max(count - 1, 1)),
+                          "lower": 1.0 / np.maximum(2 * distances - lower.value(), 1.0),
+                          "upper": 1.0 / np.maximum(2 * distances - upper.value(), 1.0)}
+
+        return self.intervals
+
+    def results(self):
+        """
+        Solved arrays of the model, e.g. to cache them, see restore
+        :return: dict with names, efficiency, lambdas (CSR), input_w and output_w
+        """
+
+        return {"names": list(self.names), "efficiency": self.efficiency, "lambdas": self.lambdas,
+                "input_w": self.input_w, "output_w": self.output_w}
+
+    def restore(self, results):
+        """
+        Load previously computed results instead of fitting, see results
+        :param results: dict as returned by results, for the same units in the same order
+        :return: nothing
+        """
+
+        assert(results["efficiency"].shape[0] == self.n)
+
+        self.efficiency = np.asarray(results["efficiency"], dtype=float).reshape(self.n, 1)
+        self.lambdas = sparse.csr_matrix(results["lambdas"])
+        self.input_w = np.asarray(results["input_w"], dtype=float)
+        self.output_w = np.asarray(results["output_w"], dtype=float)
+        self._referenced = None
+        self.intervals = None
+        self.input_slacks, self.output_slacks = None, None
+        self.frontier = np.flatnonzero(self.efficiency[:, 0] >= 1 - EFFICIENCY_TOL)
+
+    def update(self, inputs=None, outputs=None, remove=None, names=None, n_jobs=1, progress=None, cancel=None):
+        """
+        Incrementally refit after adding and/or removing units, reusing the previous solutions.
+        A kept unit keeps its score when none of its peers were removed (its solution stays feasible)
+        and its weights still hold every added unit to an efficiency of at most 1 (its dual stays
+        feasible). Only the other units and the added ones are solved again, and while the old frontier
+        is intact they are solved against the old frontier plus the added units instead of every unit.
+        Kept units stay in their order, added units are appended after them.
+        :param inputs: inputs of the added units, a x m numpy array
+        :param outputs: outputs of the added units, a x r numpy array
+        :param remove: indices of the units to remove
+        :param names: names of the added units, when units are named
+        :param n_jobs: number of worker processes for the re-solves, -1 for all cores
+        :param progress: called as progress(unit, theta) for every unit after the update, reused units first
+        :param cancel: token whose is_set() stops the re-solves with FitCancelled, leaving the model as it was
+        :return: indices (after the update) of the units that were solved again
+        """
+
+        if self.solver != "linprog":
+            raise ValueError("update is only supported by the linprog solver")
+        # the reuse tests rely on the CCR ratio weights
+        self.__require("update", measure="radial", returns="constant")
+
+        add_inputs = np.zeros((0, self.m)) if inputs is None else np.asarray(inputs, dtype=float)
+        add_outputs = np.zeros((0, self.r)) if outputs is None else np.asarray(outputs, dtype=float)
+        a = add_inputs.shape[0]
+
+        keep = np.ones(self.n, dtype=bool)
+        if remove is not None:
+            keep[np.asarray(remove, dtype=int)] = False
+        kept = np.flatnonzero(keep)
+
+        # new index of each old unit, -1 when removed
+        new_index = np.full(self.n, -1, dtype=int)
+        new_index[kept] = np.arange(len(kept))
+
+        # solutions survive unless a peer was removed ...
+        lost_peer = np.zeros(self.n, dtype=bool)
+        if not keep.all():
+            lost_peer = np.asarray((self.lambdas[:, ~keep] != 0).sum(axis=1)).ravel() > 0
+        # ... or an added unit is more than efficient under the unit's weights
+        beaten = np.zeros(self.n, dtype=bool)
+        if a > 0:
+            ratios = np.dot(self.output_w, add_outputs.T) - np.dot(self.input_w, add_inputs.T)
+            beaten = (ratios > EFFICIENCY_TOL).any(axis=1)
+        stale = (lost_peer | beaten)[kept]
+
+        # previous frontier plus the newcomers spans the new frontier, unless frontier units were removed
+        if np.isin(self.frontier, kept).all():
+            reference = np.concatenate([new_index[self.frontier], len(kept) + np.arange(a)])
+        else:
+            reference = None
+
+        # carry the surviving solutions over, with lambda columns renumbered
+        reused = np.flatnonzero(~stale)
+        lambdas = self.lambdas[kept[reused]]
+        lambdas = sparse.csr_matrix((lambdas.data, new_index[lambdas.indices], lambdas.indptr),
+                                    shape=(len(reused), len(kept) + a))
+        efficiency = np.vstack([self.efficiency[kept], np.zeros((a, 1))])
+        input_w = np.vstack([self.input_w[kept], np.zeros((a, self.m))])
+        output_w = np.vstack([self.output_w[kept], np.zeros((a, self.r))])
+        if len(self.names) > 0:
+            names = [] if names is None else list(names)
+            assert(a == len(names))
+            names = [self.names[i] for i in kept] + names
+        if progress is not None:
+            for unit in reused:
+                progress(unit, efficiency[unit, 0])
+
+        # solve the stale and the added units on the new dataset
+        new_inputs = np.vstack([self.inputs[kept], add_inputs])
+        new_outputs = np.vstack([self.outputs[kept], add_outputs])
+        solve = np.concatenate([np.flatnonzero(stale), len(kept) + np.arange(a)])
+        with instrumentation.span("dea.update", n=len(new_inputs), solved=len(solve), n_jobs=n_jobs):
+            if n_jobs == 1:
+                results = [_solve_chunk(build_model(new_inputs, new_outputs, reference, **self.options), solve,
+                                        progress, cancel)]
+            else:
+                results = _solve_parallel(new_inputs, new_outputs, n_jobs, reference, solve, progress, cancel,
+                                          options=self.options)
+        for units, thetas, _, unit_input_w, unit_output_w, _, _ in results:
+            efficiency[units, 0] = thetas
+            input_w[units] = unit_input_w
+            output_w[units] = unit_output_w
+
+        # reused rows first, then the solved ones, put back in unit order
+        rows = sparse.vstack([lambdas] + [result[2] for result in results], format="csr")
+        order = np.argsort(np.concatenate([reused, solve]), kind="stable")
+
+        # swap in the new dataset
+        if len(self.names) > 0:
+            self.names = names
+        self.inputs, self.outputs = new_inputs, new_outputs
+        self.n = self.inputs.shape[0]
+        self.unit_ = range(self.n)
+        self.model = build_model(self.inputs, self.outputs, **self.options)
+        self.efficiency, self.input_w, self.output_w = efficiency, input_w, output_w
+        self.lambdas = rows[order]
+        self._referenced = None
+        self.intervals = None
+        self.input_slacks, self.output_slacks = None, None
+        self.frontier = np.flatnonzero(self.efficiency[:, 0] >= 1 - EFFICIENCY_TOL)
+
+        return solve
 
     def name_units(self, names):
         """
@@ -134,17 +1094,40 @@ class DEA(object):
 
         self.names = names
 
-    def fit(self):
+    def fit(self, n_jobs=1, screen=False, progress=None, cancel=None, verbose=True, slacks=False, partitions=None,
+            checkpoint=None):
         """
         Optimize the dataset, generate basic table
+        :param n_jobs: number of worker processes to split the units across, -1 for all cores
+        :param screen: pre-screen the frontier so each unit's LP only carries the efficient units
+            (constant returns only)
+        :param progress: called as progress(unit, theta) as each unit is solved, in completion order
+        :param cancel: token whose is_set() is checked between units, stopping the fit with FitCancelled
+        :param verbose: print the table of thetas
+        :param slacks: also solve the max-slack second stage into input_slacks and output_slacks;
+            the sbm measure always fills them
+        :param partitions: lists of unit indices (e.g. the tracts of each state) whose efficient sets are
+            screened independently and in parallel, then merged into the frontier every unit is scored
+            against; implies screen, see partition_frontier
+        :param checkpoint: directory that keeps the screened frontier and every finished chunk of
+            CHECKPOINT_UNITS units; a fit killed midway and run again with the same directory only solves
+            what is missing. Checkpoints of a different dataset or different options, screening or slacks
+            (see the manifest.json kept next to them) are discarded and solved again (linprog only)
         :return: table
         """
 
-        self.__optimize()  # optimize
+        with instrumentation.span("dea.fit", n=self.n, solver=self.solver, n_jobs=n_jobs, screen=screen,
+                                  slacks=slacks, measure=self.options["measure"],
+                                  orientation=self.options["orientation"], returns=self.options["returns"],
+                                  model=type(self.model).__name__):
+            self.__optimize(n_jobs, screen, progress, cancel, slacks, partitions, checkpoint)  # optimize
+
+        if not verbose:
+            return
 
         print("Final thetas for each unit:\n")
         print("---------------------------\n")
-        for n, eff in enumerate(self.efficiency):
+        for n, eff in enumerate(self.efficiency.flatten()):
             if len(self.names) > 0:
                 name = "Unit %s" % self.names[n]
             else:
@@ -152,3 +1135,586 @@ class DEA(object):
             print("%s theta: %.4f" % (name, eff))
             print("\n")
         print("---------------------------\n")
+
+
+def _sparse_rows(rows, n, columns=None, tol=LAMBDA_TOL):
+    """
+    Stack lambda vectors into a CSR matrix, keeping only the peers above tolerance
+    :param rows: sequence of lambda vectors over the reference units
+    :param n: number of units, the width of the matrix
+    :param columns: unit index of each reference position, identity by default
+    :param tol: smallest lambda kept as a peer
+    :return: len(rows) x n CSR matrix
+    """
+
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    indices = [np.zeros(0, dtype=np.int64)]
+    data = [np.zeros(0, dtype=float)]
+    for i, row in enumerate(rows):
+        row = np.asarray(row, dtype=float)
+        nonzero = np.flatnonzero(row > tol)
+        indices.append(nonzero if columns is None else columns[nonzero])
+        data.append(row[nonzero])
+        indptr[i + 1] = indptr[i] + len(nonzero)
+
+    return sparse.csr_matrix((np.concatenate(data), np.concatenate(indices), indptr), shape=(len(rows), n))
+
+
+def dominated_units(inputs, outputs, block_size=256):
+    """
+    Vectorized dominance check: unit j is dominated when some unit uses no more of every
+    input, produces no less of every output and is strictly better in at least one measure.
+    Dominated units never span the frontier, so they can be dropped from the reference set.
+    :param inputs: inputs, n x m numpy array
+    :param outputs: outputs, n x r numpy array
+    :param block_size: units compared against all others at once, bounds memory at block_size x n x (m+r)
+    :return: boolean array, True for dominated units
+    """
+
+    inputs = np.asarray(inputs, dtype=float)
+    outputs = np.asarray(outputs, dtype=float)
+    n = inputs.shape[0]
+    dominated = np.zeros(n, dtype=bool)
+    for start in range(0, n, block_size):
+        block = slice(start, min(start + block_size, n))
+        # [j, k]: unit k is at least as good as unit j in every measure
+        weak = ((inputs[np.newaxis, :, :] <= inputs[block, np.newaxis, :]).all(axis=2) &
+                (outputs[np.newaxis, :, :] >= outputs[block, np.newaxis, :]).all(axis=2))
+        strict = ((inputs[np.newaxis, :, :] < inputs[block, np.newaxis, :]).any(axis=2) |
+                  (outputs[np.newaxis, :, :] > outputs[block, np.newaxis, :]).any(axis=2))
+        dominated[block] = (weak & strict).any(axis=1)
+
+    return dominated
+
+
+def frontier_units(inputs, outputs, block_size=200):
+    """
+    Find the efficient units without solving n LPs of n variables each.
+    Non-dominated units are split into blocks and each block is solved against itself only;
+    a unit that is inefficient within a block is inefficient overall, so only the block-efficient
+    units are merged and the process repeats until a single block remains (hierarchical decomposition).
+    :param inputs: inputs, n x m numpy array
+    :param outputs: outputs, n x r numpy array
+    :param block_size: units per block
+    :return: sorted indices of the efficient units
+    """
+
+    candidates = np.flatnonzero(~dominated_units(inputs, outputs))
+    while True:
+        blocks = np.array_split(candidates, max(1, int(np.ceil(len(candidates) / float(block_size)))))
+        kept = []
+        for block in blocks:
+            model = EnvelopmentModel(inputs[block], outputs[block])
+            thetas = np.array([model.solve(unit)[0] for unit in range(len(block))])
+            kept.append(block[thetas >= 1 - EFFICIENCY_TOL])
+        kept = np.concatenate(kept)
+
+        # stop after the single-block pass, or when merging blocks no longer removes anything
+        if len(blocks) == 1 or len(kept) == len(candidates):
+            candidates = kept
+            break
+        candidates = kept
+
+    if len(blocks) > 1:
+        # the last pass still had several blocks, settle the merged candidates against each other
+        model = EnvelopmentModel(inputs[candidates], outputs[candidates])
+        thetas = np.array([model.solve(unit)[0] for unit in range(len(candidates))])
+        candidates = candidates[thetas >= 1 - EFFICIENCY_TOL]
+
+    return candidates
+
+
+def partition_frontier(inputs, outputs, partitions, n_jobs=1):
+    """
+    Find the efficient units of a large dataset from independent partitions, e.g. the tracts of each state.
+    A unit that is inefficient within its partition is inefficient overall, so each partition's efficient
+    set is found on its own (in parallel, each worker only receives its partition's rows) and the merged
+    sets are settled against each other. Memory follows the largest partition, not the number of units.
+    :param inputs: inputs, n x m numpy array
+    :param outputs: outputs, n x r numpy array
+    :param partitions: lists of unit indices, together covering every unit
+    :param n_jobs: number of worker processes, -1 for all cores
+    :return: sorted indices of the efficient units
+    """
+
+    partitions = [np.asarray(partition, dtype=int) for partition in partitions if len(partition) > 0]
+    assert(sum(len(partition) for partition in partitions) == inputs.shape[0])
+    n_jobs = utils.worker_count(n_jobs, len(partitions))
+
+    tasks = [(inputs[partition], outputs[partition]) for partition in partitions]
+    with instrumentation.span("dea.partition_frontier", n=inputs.shape[0], partitions=len(partitions),
+                              n_jobs=n_jobs):
+        if n_jobs == 1:
+            frontiers = [frontier_units(*task) for task in tasks]
+        else:
+            # largest partitions first, so a big one does not start last
+            order = np.argsort([-len(partition) for partition in partitions], kind="stable")
+            frontiers = [None] * len(partitions)
+            with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+                for i, frontier in zip(order, pool.map(_partition_worker, [tasks[i] for i in order])):
+                    frontiers[i] = frontier
+
+        candidates = np.sort(np.concatenate([partition[frontier]
+                                             for partition, frontier in zip(partitions, frontiers)]))
+        instrumentation.count("dea.partition_candidates", len(candidates))
+
+        return candidates[frontier_units(inputs[candidates], outputs[candidates])]
+
+
+def _partition_worker(task):
+    """
+    Efficient units of one partition in a worker process
+    :param task: inputs, outputs of the partition
+    :return: see frontier_units
+    """
+
+    return frontier_units(*task)
+
+
+class P2Quantiles(object):
+
+    def __init__(self, p, n):
+        """
+        Running estimate of one quantile for n series at once, with the P-square algorithm
+        (Jain & Chlamtac, 1985): five markers per series, updated in constant memory per observation
+        :param p: quantile, in (0, 1)
+        :param n: number of series
+        :return: self
+        """
+
+        self.p = p
+        self.count = 0
+        self.heights = np.zeros((5, n), dtype=float)
+        self.positions = np.tile(np.arange(1.0, 6.0)[:, np.newaxis], (1, n))
+        self.desired = np.tile(np.array([1.0, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5.0])[:, np.newaxis], (1, n))
+        self.increments = np.array([0.0, p / 2, p, (1 + p) / 2, 1.0])[:, np.newaxis]
+
+    def add(self, x):
+        """
+        Add one observation of every series
+        :param x: array of length n
+        :return: nothing
+        """
+
+        x = np.asarray(x, dtype=float)
+        q, positions = self.heights, self.positions
+        if self.count < 5:
+            q[self.count] = x
+            self.count += 1
+            if self.count == 5:
+                q.sort(axis=0)
+            return
+        self.count += 1
+
+        # cell of each observation, the extreme markers follow the minimum and maximum
+        np.minimum(q[0], x, out=q[0])
+        np.maximum(q[4], x, out=q[4])
+        cell = (x >= q[1]).astype(int) + (x >= q[2]) + (x >= q[3])
+        positions += np.arange(5)[:, np.newaxis] > cell
+        self.desired += self.increments
+
+        # move the middle markers that drifted from their desired positions, parabolic where it stays ordered
+        for i in (1, 2, 3):
+            drift = self.desired[i] - positions[i]
+            up = (drift >= 1) & (positions[i + 1] - positions[i] > 1)
+            down = (drift <= -1) & (positions[i - 1] - positions[i] < -1)
+            move = up | down
+            if not move.any():
+                continue
+            step = np.where(up, 1.0, -1.0)
+            n_lo, n_i, n_hi = positions[i - 1], positions[i], positions[i + 1]
+            q_lo, q_i, q_hi = q[i - 1], q[i], q[i + 1]
+            parabolic = q_i + step / (n_hi - n_lo) * ((n_i - n_lo + step) * (q_hi - q_i) / (n_hi - n_i) +
+                                                      (n_hi - n_i - step) * (q_i - q_lo) / (n_i - n_lo))
+            linear = q_i + step * (np.where(up, q_hi, q_lo) - q_i) / (np.where(up, n_hi, n_lo) - n_i)
+            height = np.where((q_lo < parabolic) & (parabolic < q_hi), parabolic, linear)
+            q[i] = np.where(move, height, q_i)
+            positions[i] = np.where(move, n_i + step, n_i)
+
+    def value(self):
+        """
+        Current quantile estimates, exact while fewer than five observations were added
+        :return: array of length n
+        """
+
+        if self.count < 5:
+            return np.quantile(self.heights[:self.count], self.p, axis=0)
+
+        return self.heights[2].copy()
+
+
+def _bootstrap_bandwidth(distances):
+    """
+    Kernel bandwidth of the smoothed bootstrap: Silverman's rule on the distances reflected around 1,
+    rescaled from the 2n reflected points to the n fitted ones
+    :param distances: fitted Shephard distances, 1 / theta
+    :return: bandwidth
+    """
+
+    reflected = np.concatenate([distances, 2 - distances])
+    spread = reflected.std(ddof=1)
+    iqr = np.subtract(*np.percentile(reflected, [75, 25]))
+    if iqr > 0:
+        spread = min(spread, iqr / 1.349)
+
+    return 0.9 * spread * len(reflected) ** -0.2 * 2 ** 0.2
+
+
+def _bootstrap_chunk(model, distances, bandwidth, seed, replications):
+    """
+    Bootstrap thetas of every unit for a few replications, reusing one assembled model
+    :param model: EnvelopmentModel over all units, its reference inputs are overwritten
+    :param distances: fitted Shephard distances, 1 / theta
+    :param bandwidth: see _bootstrap_bandwidth
+    :param seed: seed of this chunk
+    :param replications: number of replications
+    :return: replications x n numpy array
+    """
+
+    rng = np.random.default_rng(seed)
+    n = len(distances)
+    variance = distances.var()
+    shrink = 1.0 / np.sqrt(1.0 + bandwidth ** 2 / variance) if variance > 0 else 1.0
+
+    results = np.zeros((replications, n), dtype=float)
+    for b in range(replications):
+        # draw from the reflected kernel estimate, with the variance of the fitted distances
+        draws = rng.choice(distances, n)
+        smoothed = draws.mean() + shrink * (draws + bandwidth * rng.standard_normal(n) - draws.mean())
+        smoothed = np.where(smoothed < 1.0, 2.0 - smoothed, smoothed)
+
+        # pseudo-frontier: every unit's inputs moved from its fitted to its drawn distance
+        model.scale_reference(smoothed / distances)
+        for unit in range(n):
+            results[b, unit] = model.solve(unit)[0]
+
+    return results
+
+
+def _bootstrap_worker(task):
+    """
+    Bootstrap chunk in a worker process
+    :param task: distances, bandwidth, seed, replications
+    :return: see _bootstrap_chunk
+    """
+
+    return _bootstrap_chunk(_worker_model, *task)
+
+
+# parallel solving: the worker processes attach to the data through shared memory
+_worker_model = None
+_worker_shm = None
+
+
+def _variant_thetas(inputs, outputs, input_columns, output_columns, options, screen=False):
+    """
+    Thetas of every unit on a column subset of the data
+    :param inputs: inputs, n x m numpy array
+    :param outputs: outputs, n x r numpy array
+    :param input_columns: input columns of the variant
+    :param output_columns: output columns of the variant
+    :param options: build_model keyword arguments
+    :param screen: score against the frontier found by frontier_units only
+    :return: array of thetas, length n
+    """
+
+    inputs = np.ascontiguousarray(inputs[:, input_columns])
+    outputs = np.ascontiguousarray(outputs[:, output_columns])
+    reference = frontier_units(inputs, outputs) if screen else None
+    model = build_model(inputs, outputs, reference, **options)
+
+    return np.array([model.solve(unit)[0] for unit in range(inputs.shape[0])])
+
+
+def _sensitivity_worker(task):
+    """
+    Thetas of one sensitivity variant in a worker process, on the shared data
+    :param task: input columns, output columns, build_model options, screen
+    :return: see _variant_thetas
+    """
+
+    return _variant_thetas(_worker_model.inputs * _worker_model.input_scale,
+                           _worker_model.outputs * _worker_model.output_scale, *task)
+
+
+def _init_worker(name, n, m, r, reference, options=None):
+    """
+    Worker initializer, builds the envelopment model on read-only views of the shared inputs and outputs
+    :param name: shared memory block holding the scaled inputs, the scaled outputs and their column scales
+        as float64, see _shared_arrays
+    :param n: number of units
+    :param m: number of inputs
+    :param r: number of outputs
+    :param reference: indices of the reference units
+    :param options: further build_model keyword arguments
+    :return: nothing
+    """
+
+    global _worker_model, _worker_shm
+
+    # pool workers share the parent's resource tracker, so the parent's unlink releases the block
+    _worker_shm = shared_memory.SharedMemory(name=name)
+    inputs, outputs, input_scale, output_scale = _shared_arrays(_worker_shm, n, m, r)
+    for array in (inputs, outputs):
+        array.flags.writeable = False
+    _worker_model = build_model(inputs, outputs, reference, scales=(input_scale, output_scale), **(options or {}))
+
+
+def _shared_arrays(shm, n, m, r):
+    """
+    Views of a shared memory block laid out as [scaled inputs, scaled outputs, input scale, output scale]
+    :param shm: SharedMemory of at least (n + 1) * (m + r) float64
+    :param n: number of units
+    :param m: number of inputs
+    :param r: number of outputs
+    :return: inputs (n x m), outputs (n x r), input scale (m), output scale (r), C-contiguous views
+    """
+
+    data = np.ndarray((n + 1) * (m + r), dtype=float, buffer=shm.buf)
+
+    return (data[:n * m].reshape(n, m), data[n * m:n * (m + r)].reshape(n, r),
+            data[n * (m + r):n * (m + r) + m], data[n * (m + r) + m:])
+
+
+def _check_cancel(cancel):
+    """
+    Raise FitCancelled when the cancel token is set
+    :param cancel: None or an object with is_set(), e.g. a threading.Event
+    :return: nothing
+    """
+
+    if cancel is not None and cancel.is_set():
+        raise FitCancelled("DEA solve cancelled")
+
+
+def _solve_chunk(model, units, progress=None, cancel=None, slacks=False):
+    """
+    Solve a contiguous chunk of units
+    :param model: EnvelopmentModel
+    :param units: unit indices
+    :param progress: called as progress(unit, theta) after each unit
+    :param cancel: token checked before each unit, see _check_cancel
+    :param slacks: also solve the max-slack second stage, see EnvelopmentModel.slacks
+    :return: units, thetas, lambdas (k x n CSR), input weights, output weights, input slacks, output slacks
+        (the slacks are None unless requested)
+    """
+
+    k = len(units)
+    thetas = np.zeros(k, dtype=float)
+    input_w = np.zeros((k, model.m), dtype=float)
+    output_w = np.zeros((k, model.r), dtype=float)
+    input_slacks = np.zeros((k, model.m), dtype=float) if slacks else None
+    output_slacks = np.zeros((k, model.r), dtype=float) if slacks else None
+    lambdas = []
+    for i, unit in enumerate(units):
+        _check_cancel(cancel)
+        thetas[i], unit_lambdas, input_w[i], output_w[i] = model.solve(unit)
+        lambdas.append(unit_lambdas)
+        if slacks:
+            input_slacks[i], output_slacks[i] = model.slacks(unit, thetas[i], unit_lambdas)
+        if progress is not None:
+            progress(unit, thetas[i])
+
+    return (np.asarray(units), thetas, _sparse_rows(lambdas, model.n, model.reference), input_w, output_w,
+            input_slacks, output_slacks)
+
+
+def _data_digest(*arrays):
+    """
+    Content digest of a few arrays, for checkpoint manifests
+    :param arrays: numpy arrays
+    :return: hex digest
+    """
+
+    digest = hashlib.sha256()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(str((array.dtype.str, array.shape)).encode("utf-8"))
+        digest.update(array.tobytes())
+
+    return digest.hexdigest()
+
+
+def _open_checkpoint(directory, manifest):
+    """
+    Start or resume a checkpoint directory: checkpoints written under a different manifest are removed
+    :param directory: checkpoint directory, created when missing
+    :param manifest: JSON-able description of the fit the checkpoints belong to
+    :return: nothing
+    """
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "manifest.json")
+    manifest = json.loads(json.dumps(manifest, sort_keys=True, default=str))
+    try:
+        with open(path) as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        saved = None
+    if saved == manifest:
+        return
+
+    for name in os.listdir(directory):
+        if name.endswith(".npz"):
+            os.remove(os.path.join(directory, name))
+    with utils.atomic_path(path) as tmp, open(tmp, "w") as f:
+        json.dump(manifest, f, sort_keys=True, indent=1)
+
+
+def _stack_results(results):
+    """
+    Merge chunk results into one
+    :param results: list of chunk results in unit order, see _solve_chunk
+    :return: one chunk result over all their units
+    """
+
+    def stack(position):
+        if results[0][position] is None:
+            return None
+        return np.concatenate([result[position] for result in results])
+
+    return (stack(0), stack(1), sparse.vstack([result[2] for result in results], format="csr"), stack(3), stack(4),
+            stack(5), stack(6))
+
+
+def _save_checkpoint(path, **arrays):
+    """
+    Write arrays to an .npz checkpoint atomically, a killed fit never leaves a partial file behind
+    :param path: target path
+    :param arrays: arrays by name
+    :return: nothing
+    """
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with utils.atomic_path(path) as tmp, open(tmp, "wb") as f:
+        np.savez(f, **arrays)
+
+
+def _load_checkpoint(path):
+    """
+    Read an .npz checkpoint
+    :param path: checkpoint path
+    :return: dict of arrays by name
+    """
+
+    with np.load(path) as saved:
+        return dict(saved)
+
+
+def _save_results(path, result):
+    """
+    Checkpoint one chunk result
+    :param path: target path
+    :param result: chunk result, see _solve_chunk
+    :return: nothing
+    """
+
+    units, thetas, lambdas, input_w, output_w, input_slacks, output_slacks = result
+    arrays = {"units": units, "thetas": thetas, "data": lambdas.data, "indices": lambdas.indices,
+              "indptr": lambdas.indptr, "shape": np.asarray(lambdas.shape), "input_w": input_w, "output_w": output_w}
+    if input_slacks is not None:
+        arrays.update(input_slacks=input_slacks, output_slacks=output_slacks)
+    _save_checkpoint(path, **arrays)
+
+
+def _load_results(path):
+    """
+    Read back a chunk result written by _save_results
+    :param path: checkpoint path
+    :return: chunk result, see _solve_chunk
+    """
+
+    saved = _load_checkpoint(path)
+    lambdas = sparse.csr_matrix((saved["data"], saved["indices"], saved["indptr"]), shape=tuple(saved["shape"]))
+
+    return (saved["units"], saved["thetas"], lambdas, saved["input_w"], saved["output_w"],
+            saved.get("input_slacks"), saved.get("output_slacks"))
+
+
+def _solve_worker(task):
+    """
+    Solve a chunk of units in a worker process
+    :param task: unit indices, whether to solve the slacks
+    :return: see _solve_chunk
+    """
+
+    units, slacks = task
+
+    return _solve_chunk(_worker_model, units, slacks=slacks)
+
+
+@contextlib.contextmanager
+def _shared_pool(inputs, outputs, n_jobs, reference=None, options=None):
+    """
+    Process pool whose workers build their model on one shared copy of the scaled data, see _init_worker
+    :param inputs: inputs, n x m numpy array
+    :param outputs: outputs, n x r numpy array
+    :param n_jobs: number of worker processes
+    :param reference: indices of the reference units, all units by default
+    :param options: further build_model keyword arguments
+    :return: context manager yielding the ProcessPoolExecutor
+    """
+
+    n, m = inputs.shape
+    r = outputs.shape[1]
+    shm = shared_memory.SharedMemory(create=True, size=(n + 1) * (m + r) * 8)
+    try:
+        # scaled once here, so the workers' models use the block as it is, see EnvelopmentModel
+        shared = _shared_arrays(shm, n, m, r)
+        shared[2][:] = _column_scale(inputs)
+        shared[3][:] = _column_scale(outputs)
+        shared[0][:] = inputs / shared[2]
+        shared[1][:] = outputs / shared[3]
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker,
+                                 initargs=(shm.name, n, m, r, reference, options)) as pool:
+            yield pool
+    finally:
+        del shared
+        shm.close()
+        shm.unlink()
+
+
+def _solve_parallel(inputs, outputs, n_jobs, reference=None, units=None, progress=None, cancel=None,
+                    options=None, slacks=False):
+    """
+    Split the units across a process pool sharing one copy of the scaled data
+    :param inputs: inputs, n x m numpy array
+    :param outputs: outputs, n x r numpy array
+    :param n_jobs: number of worker processes, -1 for all cores
+    :param reference: indices of the reference units, all units by default
+    :param units: indices of the units to solve, all units by default
+    :param progress: called as progress(unit, theta) for the units of each chunk as it completes
+    :param cancel: token checked as chunks complete, pending chunks are dropped when it is set
+    :param options: further build_model keyword arguments
+    :param slacks: also solve the max-slack second stage
+    :return: list of chunk results in unit order, see _solve_chunk
+    """
+
+    n = inputs.shape[0]
+    units = np.arange(n) if units is None else np.asarray(units, dtype=int)
+    n_jobs = utils.worker_count(n_jobs, len(units))
+
+    # a few chunks per worker keeps the pool balanced when some units solve slower
+    chunks = [(chunk, slacks) for chunk in np.array_split(units, n_jobs * 4) if len(chunk) > 0]
+    if len(chunks) == 0:
+        return []
+
+    with _shared_pool(inputs, outputs, n_jobs, reference, options) as pool:
+        if progress is None and cancel is None:
+            return list(pool.map(_solve_worker, chunks))
+
+        futures = [pool.submit(_solve_worker, chunk) for chunk in chunks]
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+            if cancel is not None and cancel.is_set():
+                for future in pending:
+                    future.cancel()
+                _check_cancel(cancel)
+            for future in done:
+                if progress is not None:
+                    chunk_units, thetas = future.result()[:2]
+                    for unit, theta in zip(chunk_units, thetas):
+                        progress(unit, theta)
+        return [future.result() for future in futures]
+
@@ -0,0 +1,229 @@
+"""
+Lightweight timing instrumentation for the data and DEA pipeline
+
+Named timing spans, counters and memory snapshots, collected per thread (each Streamlit script run
+has its own), viewable in an optional sidebar diagnostics panel and exportable as JSON lines.
+Everything is a no-op unless enabled, either process-wide with EJI_PROFILE=1 or per run with
+start_run(enabled=True); a disabled span costs one flag check.
+
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger("eji.instrumentation")
+
+_enabled = os.environ.get("EJI_PROFILE", "") not in ("", "0")
+_local = threading.local()
+
+
+class _NullSpan(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span(object):
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+
+    def __enter__(self):
+        self.rss = _rss_mb()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        duration = time.perf_counter() - self.start
+        rss = _rss_mb()
+        record = {"type": "span", "name": self.name, "duration_ms": 1000.0 * duration,
+                  "rss_mb": rss, "rss_delta_mb": None if rss is None else rss - self.rss}
+        record.update(self.fields)
+        _record(record)
+        return False
+
+
+def _rss_mb():
+    """
+    Resident memory of the process in MB, None where it can't be read cheaply
+    """
+
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2.0 ** 20
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def _state():
+    if not hasattr(_local, "records"):
+        _local.enabled = False
+        _local.records = []
+        _local.counters = {}
+    return _local
+
+
+def _record(record):
+    state = _state()
+    record["t"] = time.time()
+    state.records.append(record)
+    logger.debug(json.dumps(record, default=str))
+
+
+def enabled():
+    """
+    Whether instrumentation is collecting in this thread
+    :return: bool
+    """
+
+    return _enabled or getattr(_local, "enabled", False)
+
+
+def enable(process_wide=False):
+    """
+    Turn collection on for this thread, or for every thread
+    :param process_wide: enable for all threads
+    :return: nothing
+    """
+
+    global _enabled
+
+    if process_wide:
+        _enabled = True
+    else:
+        _state().enabled = True
+
+
+def start_run(enabled=False):
+    """
+    Start a fresh collection for this thread, e.g. at the top of a Streamlit page
+    :param enabled: collect during this run (process-wide enabling still applies)
+    :return: nothing
+    """
+
+    state = _state()
+    state.enabled = enabled
+    state.records = []
+    state.counters = {}
+
+
+def span(name, **fields):
+    """
+    Time a block: with span("dea.fit", n=25): ...
+    :param name: span name, dotted by stage
+    :param fields: extra fields stored with the record
+    :return: context manager
+    """
+
+    if not (_enabled or getattr(_local, "enabled", False)):
+        return _NULL_SPAN
+
+    return _Span(name, fields)
+
+
+def count(name, value=1):
+    """
+    Add to a named counter
+    :param name: counter name
+    :param value: amount to add
+    :return: nothing
+    """
+
+    if not (_enabled or getattr(_local, "enabled", False)):
+        return
+
+    counters = _state().counters
+    counters[name] = counters.get(name, 0) + value
+
+
+def snapshot(label):
+    """
+    Record the current resident memory
+    :param label: snapshot label
+    :return: nothing
+    """
+
+    if not (_enabled or getattr(_local, "enabled", False)):
+        return
+
+    _record({"type": "memory", "name": label, "rss_mb": _rss_mb()})
+
+
+def records():
+    """
+    Spans and snapshots collected in this thread, plus one record for the counters
+    :return: list of dicts
+    """
+
+    state = _state()
+    collected = list(state.records)
+    if state.counters:
+        collected.append({"type": "counters", "values": dict(state.counters)})
+
+    return collected
+
+
+def add_records(collected):
+    """
+    Add records collected in another thread to this thread's, e.g. those of a background solve;
+    counters are summed
+    :param collected: list of dicts as returned by records
+    :return: nothing
+    """
+
+    state = _state()
+    for record in collected:
+        if record["type"] == "counters":
+            for name, value in record["values"].items():
+                state.counters[name] = state.counters.get(name, 0) + value
+        else:
+            state.records.append(record)
+
+
+def export(stream):
+    """
+    Write the collected records as JSON lines
+    :param stream: writable text stream
+    :return: nothing
+    """
+
+    for record in records():
+        stream.write(json.dumps(record, default=str) + "\n")
+
+
+def render_panel():
+    """
+    Sidebar diagnostics panel for a Streamlit page, rendered at the end of the script so it
+    covers the whole run; the checkbox value takes effect from the next run (see start_run)
+    :return: nothing
+    """
+
+    import pandas as pd
+    import streamlit as st
+
+    with st.sidebar.expander("Diagnostics", expanded=False):
+        st.checkbox("Collect timings", key="show_diagnostics")
+        collected = records()
+        if not collected:
+            st.caption("Enable and rerun to collect timings for this page.")
+            return
+
+        spans = [record for record in collected if record["type"] != "counters"]
+        columns = ["type", "name", "duration_ms", "rss_mb", "rss_delta_mb"]
+        st.dataframe(pd.DataFrame(spans).reindex(columns=columns), hide_index=True)
+        for record in collected:
+            if record["type"] == "counters":
+                st.json(record["values"])
+        st.download_button("Export JSON lines", "".join(json.dumps(record, default=str) + "\n"
+                                                         for record in collected),
+                           file_name="diagnostics.jsonl", mime="application/json")
@@ -3,29 +3,30 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
 from measure_groups import eji_percentile_measures  # Import the EJI percentile measures
+import app_data  # Shared county-level data
+import eji_data  # Columnar access to the EJI tract file
+import instrumentation  # Optional timing diagnostics
 
 st.set_page_config(page_title="County Comparison - CDC EJI Explorer", page_icon="📊", layout="wide")
 with open("style.css") as f:
     st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
 
+# Timings are collected for this run when the diagnostics panel is switched on
+instrumentation.start_run(st.session_state.get("show_diagnostics", False))
+
 # Sidebar for Navigation
 st.sidebar.header("📊 County Comparison")
 st.sidebar.write("Use this page to compare Environmental Justice Index (EJI) data across multiple counties and states.")
 
-# Load the data
-@st.cache_data
-def load_data():
-    return pd.read_csv('CDC_EJI_US.csv')
-
-data = load_data()
-
-# Create a unique identifier for County and State combination
-data['County_State'] = data['COUNTY'] + ", " + data['StateDesc']
+# Load the county-level table shared by all pages
+with instrumentation.span("page.load"):
+    counties = app_data.load_counties()
+instrumentation.snapshot("page.loaded")
 
 # User Selection for State
 st.sidebar.subheader("Select States")
 st.sidebar.write("Choose one or more states to filter the available counties.")
-state_options = data['StateDesc'].unique()
+state_options = counties['StateDesc'].unique().to_numpy()
 selected_states = st.sidebar.multiselect(
     "Select States", 
     options=state_options, 
@@ -34,14 +35,14 @@ selected_states = st.sidebar.multiselect(
 
 # Filter data by selected states
 if selected_states:
-    filtered_data_by_state = data[data['StateDesc'].isin(selected_states)]
+    counties_by_state = counties[eji_data.category_mask(counties['StateDesc'], selected_states)]
 else:
-    filtered_data_by_state = data
+    counties_by_state = counties
 
 # User Selection for County and State
 st.sidebar.subheader("Select Counties and States")
 st.sidebar.write("Choose one or more counties and states to explore and compare their EJI data.")
-county_state_options = filtered_data_by_state['County_State'].unique()
+county_state_options = counties_by_state.index
 selected_counties_states = st.sidebar.multiselect(
     "Select County, State combinations", 
     options=county_state_options, 
@@ -66,21 +67,21 @@ if selected_counties_states:
         The EJI percentile measures are standardized scores that rank the relative standing of each area on specific environmental, social, and health vulnerability indicators.
     """)
 
-    filtered_data = data[data['County_State'].isin(selected_counties_states)]
-    
-    # Calculate totals and averages
-    total_population = filtered_data.groupby('County_State')['E_TOTPOP'].sum().reset_index()
-    percentile_cols = list(eji_percentile_measures[measure_group].keys())
-    percentile_means = filtered_data.groupby('County_State')[percentile_cols].mean().reset_index()
+    # Read totals and averages of the selected counties from the county table
+    with instrumentation.span("page.select", counties=len(selected_counties_states)):
+        selected_counties = counties.loc[sorted(selected_counties_states)]
+        total_population = selected_counties[['E_TOTPOP']].reset_index()
+        percentile_cols = list(eji_percentile_measures[measure_group].keys())
+        percentile_means = selected_counties[percentile_cols].reset_index()
 
-    # Convert mean percentile values to percentages (0-100)
-    percentile_means[percentile_cols] = percentile_means[percentile_cols] * 100
+        # Convert mean percentile values to percentages (0-100)
+        percentile_means[percentile_cols] = percentile_means[percentile_cols] * 100
     
-    # Check for invalid data
-    invalid_data = any(percentile_means[measure] < 0)
+        # Check for invalid data
+        invalid_data = any(percentile_means[measure] < 0)
 
-    # Merge results for visualization
-    result_data = pd.merge(total_population, percentile_means, on='County_State')
+        # Merge results for visualization
+        result_data = pd.merge(total_population, percentile_means, on='County_State')
 
     # Display pie chart for total population in a container with border
     with st.container(border=True):
@@ -95,14 +96,15 @@ if selected_counties_states:
             absolute = int(np.round(pct/100.*np.sum(allvals)))
             return f"{absolute:,} ({pct:.1f}%)"
 
-        fig, ax = plt.subplots()
-        wedges, texts, autotexts = ax.pie(
-            result_data['E_TOTPOP'], labels=result_data['County_State'], autopct=lambda pct: autopct_format(pct, result_data['E_TOTPOP']),
-            startangle=90, colors=colors
-        )
-        ax.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle.
-        plt.setp(autotexts, size=10, weight="bold")
-        st.pyplot(fig)
+        with instrumentation.span("render.population_pie"):
+            fig, ax = plt.subplots()
+            wedges, texts, autotexts = ax.pie(
+                result_data['E_TOTPOP'], labels=result_data['County_State'], autopct=lambda pct: autopct_format(pct, result_data['E_TOTPOP']),
+                startangle=90, colors=colors
+            )
+            ax.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle.
+            plt.setp(autotexts, size=10, weight="bold")
+            st.pyplot(fig)
 
     # Display horizontal bar chart for selected measure in a container with border
     if not invalid_data:
@@ -121,13 +123,14 @@ if selected_counties_states:
                 { 'Higher values may indicate increased risk or burden, which is concerning for communities.' if eji_percentile_measures[measure_group][measure]['higher_is'] == 'bad' else 'Higher values may indicate better conditions or resilience, which is beneficial for communities.'}
             """)
 
-            fig, ax = plt.subplots()
-            result_data = result_data.sort_values(by=measure, ascending=False)
-            ax.barh(result_data['County_State'], result_data[measure], color='teal')
-            ax.set_xlabel(f'{eji_percentile_measures[measure_group][measure]["description"]} (%)')
-            ax.set_ylabel('County, State')
-            ax.invert_yaxis()  # Invert y-axis to have the highest values at the top
-            st.pyplot(fig)
+            with instrumentation.span("render.measure_bar"):
+                fig, ax = plt.subplots()
+                result_data = result_data.sort_values(by=measure, ascending=False)
+                ax.barh(result_data['County_State'], result_data[measure], color='teal')
+                ax.set_xlabel(f'{eji_percentile_measures[measure_group][measure]["description"]} (%)')
+                ax.set_ylabel('County, State')
+                ax.invert_yaxis()  # Invert y-axis to have the highest values at the top
+                st.pyplot(fig)
     else:
         with st.container(border=True):
             st.markdown("<h2 style='color: #007bff;'>Percentile Measure Comparison</h2>", unsafe_allow_html=True)
@@ -135,3 +138,6 @@ if selected_counties_states:
 else:
     st.markdown("## Instructions")
     st.write("To begin your analysis, please select one or more states and counties from the sidebar. You can then choose a measure group and specific measure to compare across these counties.")
+
+# Optional timing and memory diagnostics of this run
+instrumentation.render_panel()
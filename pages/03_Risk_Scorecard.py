@@ -1,27 +1,26 @@
 import streamlit as st
-import pandas as pd
 from measure_groups import eji_percentile_measures  # Import the EJI percentile measures
+import app_data  # Shared county-level data
+import instrumentation  # Optional timing diagnostics
 
 st.set_page_config(page_title="Risk Scorecard - CDC EJI Explorer", page_icon="🛡️", layout="wide")
 with open("style.css") as f:
     st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
 
-# Load the data
-@st.cache_data
-def load_data():
-    return pd.read_csv('CDC_EJI_US.csv')
+# Timings are collected for this run when the diagnostics panel is switched on
+instrumentation.start_run(st.session_state.get("show_diagnostics", False))
 
-data = load_data()
-
-# Create a unique identifier for County and State combination
-data['County_State'] = data['COUNTY'] + ", " + data['StateDesc']
+# Load the county index shared by all pages
+with instrumentation.span("page.load"):
+    county_index = app_data.load_county_index()
+instrumentation.snapshot("page.loaded")
 
 # Sidebar for County and State selection
 st.sidebar.header("🛡️ Risk Scorecard")
 st.sidebar.write("Use this page to view detailed Environmental Justice Index (EJI) information for a specific county and state.")
 selected_county_state = st.sidebar.selectbox(
     "Select a County, State combination", 
-    options=data['County_State'].unique(),
+    options=county_index.names,
     help="Select a county to view its risk scorecard."
 )
 
@@ -48,34 +47,40 @@ st.title("🛡️ Risk Scorecard")
 st.write("The Risk Scorecard provides a detailed overview of the Environmental Justice Index (EJI) measures for the selected county and state. Use this page to explore specific vulnerabilities and strengths in various categories.")
 
 if selected_county_state:
-    # Filter data for the selected County, State
-    county_data = data[data['County_State'] == selected_county_state]
+    # Look up the precomputed row of the selected County, State by its code
+    with instrumentation.span("page.lookup"):
+        county_code = county_index.code(selected_county_state)
+        county_data = dict(zip(county_index.columns, county_index.means[county_code]))
 
-    # Sum the population across all rows (tracts) for the selected county-state
-    total_population = county_data['E_TOTPOP'].sum()
+        # Population summed across all tracts of the selected county-state
+        total_population = int(county_index.sums[county_code, county_index.column('E_TOTPOP')])
 
     # Display Total Population in large numbers
     st.markdown(f"<h1 style='text-align: center; color: #007bff;'>Population: {total_population:,}</h1>", unsafe_allow_html=True)
 
     # Display measures in cards under expanders
-    for category, measures in eji_percentile_measures.items():
-        with st.expander(f"{category} Measures (click to expand)", expanded=False):
-            st.markdown(f"### {category}")
-            st.write(f"The following measures provide insights into the {category.lower()} aspects of the selected county. Higher values may indicate either greater risk or greater benefit, depending on the measure's context.")
+    with instrumentation.span("render.scorecard"):
+        for category, measures in eji_percentile_measures.items():
+            with st.expander(f"{category} Measures (click to expand)", expanded=False):
+                st.markdown(f"### {category}")
+                st.write(f"The following measures provide insights into the {category.lower()} aspects of the selected county. Higher values may indicate either greater risk or greater benefit, depending on the measure's context.")
             
-            cols = st.columns(3)  # Create three columns for cards
-            for i, (measure, details) in enumerate(measures.items()):
-                # Calculate the average for the selected measure across all tracts
-                value = county_data[measure].mean() * 100  # Convert to percentage
-                color = get_color(value, details['higher_is'])
-                with cols[i % 3]:  # Distribute cards across columns
-                    st.markdown(f"""
-                    <div style="border: 1px solid #ddd; border-radius: 8px; padding: 20px; background-color: #f9f9f9; text-align: center; height:225px; margin-bottom: 15px;">
-                        <h4 style="color: {color};">{details['description']}</h4>
-                        <p>Value: <span style="color: {color}; font-size: 24px;">{value:.2f}%</span></p>
-                        <p style="font-size: 12px;">{details['context']}</p>
-                    </div>
-                    """, unsafe_allow_html=True)
+                cols = st.columns(3)  # Create three columns for cards
+                for i, (measure, details) in enumerate(measures.items()):
+                    # Average of the selected measure across all tracts
+                    value = county_data[measure] * 100  # Convert to percentage
+                    color = get_color(value, details['higher_is'])
+                    with cols[i % 3]:  # Distribute cards across columns
+                        st.markdown(f"""
+                        <div style="border: 1px solid #ddd; border-radius: 8px; padding: 20px; background-color: #f9f9f9; text-align: center; height:225px; margin-bottom: 15px;">
+                            <h4 style="color: {color};">{details['description']}</h4>
+                            <p>Value: <span style="color: {color}; font-size: 24px;">{value:.2f}%</span></p>
+                            <p style="font-size: 12px;">{details['context']}</p>
+                        </div>
+                        """, unsafe_allow_html=True)
 else:
     st.markdown("## Instructions")
     st.write("Please select a County, State combination from the sidebar to view the detailed risk scorecard for that region.")
+
+# Optional timing and memory diagnostics of this run
+instrumentation.render_panel()
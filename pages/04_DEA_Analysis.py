@@ -2,14 +2,25 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import random
+import copy
 from envelopment import DEA  # Importing the DEA class from envelopment.py
-from measure_groups import dea_measures  # Importing measures from measure_groups.py
+from measure_groups import dea_measures  # Descriptions of the DEA measures
+from dea_cache import DEACache  # Shared cache of DEA results
+import dea_jobs  # Background DEA solves
+import dea_artifacts  # Precomputed results of the standard groupings
+import app_data  # Shared county-level data
+import eji_data  # Columnar access to the EJI tract file
+import preprocessing  # Normalization of DEA inputs and outputs
+import instrumentation  # Optional timing diagnostics
 
 # Set page configuration
 st.set_page_config(page_title="Performance Analysis - CDC EJI Explorer", page_icon="📈", layout="wide")
 with open("style.css") as f:
     st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
 
+# Timings are collected for this run when the diagnostics panel is switched on
+instrumentation.start_run(st.session_state.get("show_diagnostics", False))
+
 # Page title
 st.title("📈 Performance Analysis")
 st.write("""
@@ -17,15 +28,54 @@ This page allows you to assess how well selected counties are performing in mana
 The analysis helps identify counties that effectively minimize negative impacts while promoting positive health outcomes.
 """)
 
-# Load the data
-@st.cache_data
-def load_data():
-    return pd.read_csv('CDC_EJI_US.csv')
+# Load the county-level table shared by all pages
+with instrumentation.span("page.load"):
+    counties = app_data.load_counties()
+instrumentation.snapshot("page.loaded")
+
+# One results cache shared by all sessions, with an on-disk tier that survives restarts
+@st.cache_resource
+def get_dea_cache():
+    return DEACache()
+
+dea_cache = get_dea_cache()
+
+# Precomputed national and per-state results, memory-mapped once per dataset version and build; a missing
+# build is not cached, so artifacts built while the server runs are picked up on the next run
+@st.cache_resource(max_entries=2)
+def get_dea_artifacts(version, build_stamp):
+    input_measures, output_measures = eji_data.dea_columns()
+    return dea_artifacts.load(version, input_measures, output_measures)
 
-data = load_data()
+artifacts = None
+artifact_stamp = dea_artifacts.build_stamp(eji_data.dataset_version(), *eji_data.dea_columns())
+if artifact_stamp is not None:
+    artifacts = get_dea_artifacts(eji_data.dataset_version(), artifact_stamp)
 
-# Create a unique identifier for County and State combination
-data['County_State'] = data['COUNTY'] + ", " + data['StateDesc']
+# Solves run on a small thread pool shared by all sessions, so a large selection never blocks the script run
+@st.cache_resource
+def get_dea_executor():
+    return dea_jobs.executor()
+
+# Progress of the running solve, polled until it finishes and then handed to a full rerun
+@st.fragment(run_every=0.5)
+def show_dea_progress():
+    job = st.session_state.get("dea_job")
+    if job is None:
+        return
+    scores = job.poll()
+    if job.done():
+        st.rerun()
+
+    st.progress(len(scores) / max(job.total, 1), text=f"Solved {len(scores)} of {job.total} counties")
+    if st.button("Cancel Analysis"):
+        job.cancel()
+    if scores:
+        st.markdown("### Partial Performance Scores")
+        st.dataframe(pd.DataFrame({
+            "County_State": list(scores.keys()),
+            "Performance Score": list(scores.values())
+        }).sort_values("County_State"), hide_index=True)
 
 # Initialize session state for selected counties
 if "selected_counties" not in st.session_state:
@@ -41,68 +91,129 @@ st.sidebar.write("""
 
 # Button to randomly select 25 counties outside the form
 if st.button("Select Random 25 Counties"):
-    st.session_state["selected_counties"] = random.sample(list(data['County_State'].unique()), 25)
+    st.session_state["selected_counties"] = random.sample(list(counties.index), 25)
+
+# Standard comparisons are served straight from the precomputed results
+if artifacts is not None:
+    standard = st.selectbox("Standard comparison", options=range(len(artifacts.groups)),
+                            format_func=lambda i: artifacts.groups[i]["group"])
+    if st.button("Select Standard Comparison"):
+        st.session_state["selected_counties"] = artifacts.labels(standard)
 
 # Sidebar for County and State selection within a form
 with st.sidebar.form(key="county_selection_form"):
     selected_counties_states = st.multiselect(
         "Select County, State combinations", 
-        options=data['County_State'].unique(),
+        options=counties.index,
         default=st.session_state["selected_counties"],
         help="Choose multiple counties to evaluate their relative performance in managing environmental and health outcomes."
     )
     
     submit_button = st.form_submit_button(label="Run Performance Analysis")
 
-# Main content
+# Prepare the submitted selection and start its solve
 if submit_button and selected_counties_states:
-    st.markdown("## Performance Analysis Results")
-    st.write("""
-    The results below show the performance scores for each selected county. 
-    A performance score close to or equal to 1 indicates that a county is effectively managing its environmental burdens, social vulnerabilities, and health outcomes relative to other selected counties.
-    """)
-
-    # Filter the data to only include the selected counties
-    filtered_data = data[data['County_State'].isin(selected_counties_states)]
-    
     # Extract input and output measures from dea_measures
-    input_measures = []
-    for category in dea_measures["inputs"].values():
-        input_measures.extend(category.keys())
-
-    output_measures = []
-    for category in dea_measures["outputs"].values():
-        output_measures.extend(category.keys())
+    input_measures, output_measures = eji_data.dea_columns()
 
     # Select only the columns that are needed for the performance analysis
     columns_to_average = input_measures + output_measures
 
-    # Average the input and output measures for each DMU (county_state)
-    grouped_data = filtered_data.groupby('County_State')[columns_to_average].mean()
+    # Input and output measures averaged for each DMU (county_state), read from the county table
+    grouped_data = counties.loc[sorted(selected_counties_states), columns_to_average]
 
-    # Replace zeros with a small positive value
-    grouped_data.replace(0, 1e-6, inplace=True)
-
-    # Verify and normalize input/output measures
-    for col in columns_to_average:
-        grouped_data[col] = grouped_data[col].apply(lambda x: max(1e-6, min(1, x / 100.0)))
+    # Normalize input/output measures to (0, 1], zeros and negatives floored at a small positive value
+    grouped_data = preprocessing.normalize_frame(grouped_data, columns_to_average)
 
     # Extract the input and output data after normalization
-    input_data = grouped_data[input_measures].values
-    output_data = grouped_data[output_measures].values
+    input_data, output_data = preprocessing.dea_arrays(grouped_data, input_measures, output_measures)
     dmu_labels = grouped_data.index.values
 
-    # Perform DEA using the custom DEA class
-    dea = DEA(inputs=input_data, outputs=output_data)
-    dea.name_units(dmu_labels)
-    dea.fit()
+    # Identical selections (same counties, measures, solver and data file) are served from the cache
+    cache_key = DEACache.key(dmu_labels, input_measures, output_measures, solver="linprog", scaling="percentile",
+                             data_version=eji_data.dataset_version())
+    cached = artifacts.lookup(dmu_labels) if artifacts is not None else None
+    if cached is None:
+        cached = dea_cache.get(cache_key)
+    instrumentation.count("dea.cache_hits" if cached is not None else "dea.cache_misses")
+
+    # A new selection supersedes the solve still running for the previous one
+    running = st.session_state.get("dea_job")
+    if running is not None:
+        running.cancel()
+        st.session_state["dea_job"] = None
+
+    # Perform DEA using the custom DEA class, reusing the previous run when the selection only changed partly
+    previous = st.session_state.get("dea_model")
+    selected_labels = set(dmu_labels)
+    if cached is not None:
+        dea = DEA(inputs=grouped_data.loc[cached["names"], input_measures].values,
+                  outputs=grouped_data.loc[cached["names"], output_measures].values)
+        dea.name_units(cached["names"])
+        dea.restore(cached)
+        st.session_state["dea_model"] = dea
+    else:
+        if previous is not None and set(previous.names) & selected_labels:
+            previous_labels = set(previous.names)
+            removed = [i for i, name in enumerate(previous.names) if name not in selected_labels]
+            added = [name for name in dmu_labels if name not in previous_labels]
+            names = [name for name in previous.names if name in selected_labels] + added
+            added_inputs = grouped_data.loc[added, input_measures].values
+            added_outputs = grouped_data.loc[added, output_measures].values
+
+            def solve(progress, cancel):
+                dea = copy.deepcopy(previous)  # the finished model stays untouched for other reruns
+                if removed or added:
+                    dea.update(inputs=added_inputs, outputs=added_outputs, remove=removed, names=added,
+                               progress=progress, cancel=cancel)
+                return dea
+        else:
+            names = list(dmu_labels)
+
+            def solve(progress, cancel):
+                dea = DEA(inputs=input_data, outputs=output_data)
+                dea.name_units(dmu_labels)
+                dea.fit(progress=progress, cancel=cancel, verbose=False)
+                return dea
+
+        st.session_state["dea_job"] = dea_jobs.DEAJob(solve, names).submit(get_dea_executor())
+        st.session_state["dea_job_key"] = cache_key
+
+# Main content, kept on screen while the solve of the last submitted selection runs
+job = st.session_state.get("dea_job")
+show_results = (submit_button and selected_counties_states) or job is not None
+dea = None
+if show_results:
+    st.markdown("## Performance Analysis Results")
+    st.write("""
+    The results below show the performance scores for each selected county. 
+    A performance score close to or equal to 1 indicates that a county is effectively managing its environmental burdens, social vulnerabilities, and health outcomes relative to other selected counties.
+    """)
+
+    # Solved results replace the progress view once the background job is done
+    if job is None:
+        dea = st.session_state.get("dea_model")
+    elif not job.done():
+        show_dea_progress()
+    else:
+        st.session_state["dea_job"] = None
+        instrumentation.add_records(job.records)  # timings of the solve, collected on the pool thread
+        if job.error is not None:
+            st.error(f"The performance analysis failed: {job.error}")
+        elif job.result is None:
+            st.warning("The performance analysis was cancelled.")
+        else:
+            dea = job.result
+            dea_cache.put(st.session_state["dea_job_key"], dea.results())
+            st.session_state["dea_model"] = dea
 
+if dea is not None:
     # Structure the outputs
     # 1. Performance Scores Table
     performance_df = pd.DataFrame({
-        "County_State": dmu_labels,
+        "County_State": dea.names,
         "Performance Score": dea.efficiency.flatten()
-    })
+    }).sort_values("County_State").reset_index(drop=True)
 
     # Consider scores >= 0.95 as high-performing
     performance_df["Status"] = np.where(performance_df["Performance Score"] >= 0.95, "High-Performing", "Needs Improvement")
@@ -114,26 +225,43 @@ if submit_button and selected_counties_states:
     Counties with lower scores may need to enhance their efforts in these areas.
     """)
     
-    cols = st.columns(3)
-    for i, row in performance_df.iterrows():
-        with cols[i % 3]:
-            color = "green" if row["Status"] == "High-Performing" else "red"
-            st.markdown(f"""
-            <div style="border: 1px solid #ddd; border-radius: 8px; padding: 20px; background-color: #f9f9f9; text-align: center; margin-bottom: 15px;">
-                <h4 style="color: {color};">{row["County_State"]}</h4>
-                <p>Performance Score: <span style="color: {color}; font-size: 24px;">{row["Performance Score"]:.4f}</span></p>
-                <p style="font-size: 14px;">Status: {row["Status"]}</p>
-            </div>
-            """, unsafe_allow_html=True)
+    with instrumentation.span("render.scores", counties=len(performance_df)):
+        cols = st.columns(3)
+        for i, row in performance_df.iterrows():
+            with cols[i % 3]:
+                color = "green" if row["Status"] == "High-Performing" else "red"
+                st.markdown(f"""
+                <div style="border: 1px solid #ddd; border-radius: 8px; padding: 20px; background-color: #f9f9f9; text-align: center; margin-bottom: 15px;">
+                    <h4 style="color: {color};">{row["County_State"]}</h4>
+                    <p>Performance Score: <span style="color: {color}; font-size: 24px;">{row["Performance Score"]:.4f}</span></p>
+                    <p style="font-size: 14px;">Status: {row["Status"]}</p>
+                </div>
+                """, unsafe_allow_html=True)
 
     # 2. Summary of Results
     st.markdown("### Summary of Performance Results")
     num_high_performing = np.sum(performance_df["Status"] == "High-Performing")
-    num_needs_improvement = len(dmu_labels) - num_high_performing
+    num_needs_improvement = len(performance_df) - num_high_performing
     st.write(f"**Number of High-Performing Counties:** {num_high_performing}")
     st.write(f"**Number of Counties Needing Improvement:** {num_needs_improvement}")
 
-else:
+    # 3. Improvement Targets, projected onto the frontier from the solved peer weights for all counties at once
+    if num_needs_improvement > 0:
+        st.markdown("### Improvement Targets")
+        st.write("""
+        For each county needing improvement, the reduction of each burden and vulnerability measure (in % of its current value) 
+        that would bring it up to the performance of its peers.
+        """)
+        input_measures = dea_measures["inputs"]
+        descriptions = {column: label.split(" (")[0] for measures in input_measures.values() for column, label in measures.items()}
+        with instrumentation.span("render.targets", counties=num_needs_improvement):
+            targets = dea.targets()
+            reductions = pd.DataFrame(100 * targets["input_gaps"] / dea.inputs, index=dea.names,
+                                      columns=[descriptions[column] for column in eji_data.dea_columns()[0]])
+            needs_improvement = performance_df.loc[performance_df["Status"] == "Needs Improvement", "County_State"]
+            st.dataframe(reductions.loc[needs_improvement].round(1), column_config={"_index": "County_State"})
+
+elif not show_results:
     st.markdown("## Instructions")
     st.write("""
     To begin the performance analysis:
@@ -142,3 +270,5 @@ else:
     The analysis will compare the performance of these counties in handling environmental burdens, social vulnerabilities, and health outcomes.
     """)
 
+# Optional timing and memory diagnostics of this run
+instrumentation.render_panel()
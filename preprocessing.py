@@ -0,0 +1,81 @@
+"""
+Normalization of DEA inputs and outputs
+
+Scaling, clipping and zero-flooring are applied to the whole units x measures matrix at once,
+producing contiguous float arrays that can be passed to the DEA constructor as they are.
+
+"""
+
+import numpy as np
+import pandas as pd
+
+import instrumentation
+
+# smallest value a measure may take, DEA needs strictly positive data
+FLOOR = 1e-6
+
+SCALINGS = ("percentile", "minmax", "mean")
+
+
+def normalize(values, scaling="percentile", floor=FLOOR):
+    """
+    Scale, clip and floor a units x measures matrix
+    percentile: x / 100, clipped to [floor, 1]
+    minmax: (x - column min) / (column max - column min), clipped to [floor, 1]
+    mean: x / column mean, floored
+    Missing values end up at the upper bound for percentile/minmax and at the floor for mean.
+    :param values: units x measures array
+    :param scaling: one of SCALINGS
+    :param floor: smallest value after scaling
+    :return: new C-contiguous float array
+    """
+
+    if scaling not in SCALINGS:
+        raise ValueError("Unknown scaling %r, expected one of %s" % (scaling, ", ".join(SCALINGS)))
+
+    values = np.array(values, dtype=float, order="C")  # the one working copy, scaled in place
+    if scaling == "percentile":
+        values /= 100.0
+    elif scaling == "minmax":
+        low = np.nanmin(values, axis=0)
+        spread = np.nanmax(values, axis=0) - low
+        values -= low
+        values /= np.where(spread > 0, spread, 1.0)
+    else:
+        mean = np.nanmean(values, axis=0)
+        values /= np.where(mean != 0, mean, 1.0)
+
+    # fmin/fmax skip NaN, the same as the built-in min/max the pages used to apply per element
+    if scaling != "mean":
+        np.fmin(values, 1.0, out=values)
+    np.fmax(values, floor, out=values)
+
+    return values
+
+
+def normalize_frame(frame, columns, scaling="percentile", floor=FLOOR):
+    """
+    Normalized copy of the given columns of a frame, see normalize
+    :param frame: DataFrame of units
+    :param columns: measure columns
+    :param scaling: one of SCALINGS
+    :param floor: smallest value after scaling
+    :return: DataFrame with the same index
+    """
+
+    with instrumentation.span("preprocessing.normalize", units=len(frame), scaling=scaling):
+        return pd.DataFrame(normalize(frame[columns].to_numpy(dtype=float), scaling, floor),
+                            index=frame.index, columns=columns)
+
+
+def dea_arrays(frame, input_measures, output_measures):
+    """
+    Contiguous input and output arrays for the DEA constructor
+    :param frame: normalized DataFrame of units
+    :param input_measures: input columns
+    :param output_measures: output columns
+    :return: inputs (n x m), outputs (n x r)
+    """
+
+    return (np.ascontiguousarray(frame[input_measures].to_numpy(dtype=float)),
+            np.ascontiguousarray(frame[output_measures].to_numpy(dtype=float)))
@@ -0,0 +1,64 @@
+"""
+Small helpers shared by the DEA pipeline
+
+The worker count behind every n_jobs argument and the write-then-swap used for every file or
+directory that a concurrent reader or a killed run could otherwise see half written.
+
+"""
+
+import contextlib
+import os
+import shutil
+import uuid
+
+
+def worker_count(n_jobs, tasks=None):
+    """
+    Worker processes for an n_jobs argument
+    :param n_jobs: requested worker processes, None or below 1 for all cores
+    :param tasks: number of tasks to spread, caps the count so no worker sits idle
+    :return: worker count, at least 1
+    """
+
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = os.cpu_count() or 1
+    if tasks is not None:
+        n_jobs = min(n_jobs, tasks)
+
+    return max(1, n_jobs)
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+@contextlib.contextmanager
+def atomic_path(path):
+    """
+    Temporary path next to a file or directory target, swapped in for the target when the block completes
+    and removed when it fails, so readers only ever see a complete target or none at all.
+    Every writer gets its own temporary name, so threads of one process writing the same target do not
+    write into each other's files; the last complete write wins.
+    An existing target directory is moved aside first and removed after the swap, memory maps of its
+    files stay valid.
+    :param path: target path
+    :return: context manager yielding the temporary path to write
+    """
+
+    tmp = "%s.%s.tmp" % (path, uuid.uuid4().hex)
+    try:
+        yield tmp
+    except BaseException:
+        _remove(tmp)
+        raise
+
+    old = None
+    if os.path.isdir(path):
+        old = "%s.%s.old" % (path, uuid.uuid4().hex)
+        os.replace(path, old)
+    os.replace(tmp, path)
+    if old is not None:
+        shutil.rmtree(old)